@@ -16,22 +16,23 @@ else:
     for t in tables:
         print(f"- {t[0]}")
     
-    # helper to print count
-    def print_count(table_name):
-        try:
-            cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-            count = cursor.fetchone()[0]
-            print(f"\n[{table_name}] Total records: {count}")
-            return count
-        except:
-            print(f"\n[{table_name}] (Table not found or error)")
-            return 0
-
+    # Count every known table in a single UNION ALL query
     print("\n--- Data Statistics ---")
-    print_count("users")
-    print_count("sessions")
-    print_count("quizzes")
-    print_count("submissions")
+    stat_tables = ("users", "sessions", "quizzes", "submissions")
+    existing = {t[0] for t in tables}
+    counts = {}
+    try:
+        counted = [name for name in stat_tables if name in existing]
+        if counted:
+            cursor.execute(" UNION ALL ".join(f"SELECT '{name}', COUNT(*) FROM {name}" for name in counted))
+            counts = dict(cursor.fetchall())
+    except sqlite3.Error as e:
+        print(f"\nCount query failed: {e}")
+    for name in stat_tables:
+        if name in counts:
+            print(f"\n[{name}] Total records: {counts[name]}")
+        else:
+            print(f"\n[{name}] (Table not found or error)")
 
     # Show recent users
     print("\n--- Recent Users ---")
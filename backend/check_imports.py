@@ -1,38 +1,33 @@
 import sys
-import os
+import importlib.util
+import importlib.metadata as md
 print(f"Python: {sys.version}")
 print("Checking imports...")
 
-try:
-    import torch
-    print(f"Torch: {torch.__version__}")
-except ImportError as e:
-    print(f"Torch not found: {e}")
-except Exception as e:
-    print(f"Torch import error: {e}")
+# (display name, import name, distribution name)
+# find_spec only locates the package, it doesn't import torch/cv2/etc.
+PACKAGES = [
+    ("Torch", "torch", "torch"),
+    ("EasyOCR", "easyocr", "easyocr"),
+    ("OpenCV", "cv2", ("opencv-python", "opencv-python-headless")),
+    ("Google GenAI", "google.generativeai", "google-generativeai"),
+    ("gRPC", "grpc", "grpcio"),
+]
 
-try:
-    import easyocr
-    print(f"EasyOCR: {easyocr.__version__}")
-except ImportError as e:
-    print(f"EasyOCR not found: {e}")
-except Exception as e:
-    print(f"EasyOCR import error: {e}")
+for label, module, dists in PACKAGES:
+    try:
+        spec = importlib.util.find_spec(module)
+    except ModuleNotFoundError:
+        spec = None
+    if spec is None:
+        print(f"{label} not found")
+        continue
 
-try:
-    import cv2
-    print(f"OpenCV: {cv2.__version__}")
-except ImportError as e:
-    print(f"OpenCV not found: {e}")
-
-try:
-    import google.generativeai as genai
-    print(f"Google GenAI: {genai.__version__}")
-except ImportError as e:
-    print(f"Google GenAI not found: {e}")
-
-try:
-    import grpc
-    print(f"gRPC: {grpc.__version__}")
-except ImportError as e:
-    print(f"gRPC not found: {e}")
+    version = "unknown"
+    for dist in (dists,) if isinstance(dists, str) else dists:
+        try:
+            version = md.version(dist)
+            break
+        except md.PackageNotFoundError:
+            continue
+    print(f"{label}: {version}")
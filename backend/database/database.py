@@ -1,24 +1,275 @@
 import sqlite3
-import json
+import orjson
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import os
-import uuid
+import secrets
+import hashlib
+import atexit
+import threading
+import queue
+from pathlib import Path
+from contextlib import contextmanager
+from collections import OrderedDict
+
+
+# Hot statements are kept as module-level constants so every call hands sqlite3 the
+# exact same string and hits the per-connection statement cache.
+_SQL_INSERT_USER = """
+    INSERT INTO users (user_id, email, username, hashed_password)
+    VALUES (?, ?, ?, ?)
+"""
+# Served entirely from idx_users_email_cover (no second lookup into the users table).
+# INDEXED BY is needed because the planner otherwise prefers the UNIQUE(email) autoindex.
+_SQL_GET_USER_BY_EMAIL = "SELECT user_id, username, hashed_password, created_at FROM users INDEXED BY idx_users_email_cover WHERE email = ?"
+_SQL_INSERT_SESSION = """
+    INSERT INTO sessions (session_id, user_id, image_path, extracted_text, topics, status)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+_SQL_UPDATE_SESSION_TOPICS = "UPDATE sessions SET extracted_text = ?, topics = ?, status = ? WHERE session_id = ?"
+# Conditional, so two retries of the same failed session can't both queue an OCR job
+_SQL_RETRY_SESSION = "UPDATE sessions SET status = 'processing' WHERE session_id = ? AND status = 'failed'"
+_SQL_GET_SESSION = "SELECT session_id, user_id, image_path, extracted_text, topics, created_at, status FROM sessions WHERE session_id = ?"
+_SQL_INSERT_QUIZ = """
+    INSERT INTO quizzes (quiz_id, session_id, quiz_data, quiz_type, difficulty)
+    VALUES (?, ?, ?, ?, ?)
+"""
+_SQL_GET_QUIZ = "SELECT quiz_data FROM quizzes WHERE quiz_id = ?"
+_SQL_INSERT_SUBMISSION = """
+    INSERT INTO submissions (submission_id, quiz_id, session_id, score, results)
+    VALUES (?, ?, ?, ?, ?)
+"""
+_SQL_GET_LAST_STATS = """
+    SELECT (SELECT score FROM submissions 
+            WHERE session_id = ?1 
+            ORDER BY created_at DESC 
+            LIMIT 1) AS score,
+           (SELECT difficulty FROM quizzes 
+            WHERE session_id = ?1 
+            ORDER BY created_at DESC 
+            LIMIT 1) AS difficulty
+"""
+_SQL_GET_SESSION_SUBMISSION_STAMP = "SELECT MAX(created_at), COUNT(*) FROM submissions WHERE session_id = ?"
+# Question texts are pulled out of the stored quiz JSON by SQLite, oldest quiz first. Only string
+# questions: older versions stored whatever the model returned, numbers and null included
+_SQL_GET_SESSION_QUESTIONS = """
+    SELECT json_extract(question.value, '$.question')
+    FROM quizzes q, json_each(q.quiz_data, '$.questions') AS question
+    WHERE q.session_id = ? AND json_valid(q.quiz_data)
+      AND json_type(question.value, '$.question') = 'text'
+    ORDER BY q.rowid, question.key
+"""
+# Newest first; callers reverse back to oldest-first
+_SQL_GET_RECENT_SESSION_QUESTIONS = """
+    SELECT json_extract(question.value, '$.question')
+    FROM quizzes q, json_each(q.quiz_data, '$.questions') AS question
+    WHERE q.session_id = ? AND json_valid(q.quiz_data)
+      AND json_type(question.value, '$.question') = 'text'
+    ORDER BY q.rowid DESC, question.key DESC
+    LIMIT ?
+"""
+_SQL_INSERT_QUESTION_HASH = "INSERT OR IGNORE INTO session_question_hashes (session_id, hash) VALUES (?, ?)"
+_SQL_GET_QUESTION_HASHES = "SELECT hash FROM session_question_hashes WHERE session_id = ?"
+# Every stored question, used once to fill session_question_hashes for an existing database
+_SQL_GET_ALL_QUESTIONS = """
+    SELECT q.session_id, json_extract(question.value, '$.question')
+    FROM quizzes q, json_each(q.quiz_data, '$.questions') AS question
+    WHERE json_valid(q.quiz_data) AND json_type(question.value, '$.question') = 'text'
+"""
+_SQL_GET_SESSION_SUBMISSIONS = """
+    SELECT s.score, s.created_at, se.topics 
+    FROM submissions s
+    JOIN quizzes q ON s.quiz_id = q.quiz_id
+    LEFT JOIN sessions se ON se.session_id = s.session_id
+    WHERE s.session_id = ? 
+    ORDER BY s.created_at
+"""
+# Per-Bloom-level accuracy and timing, aggregated inside SQLite: each stored result is
+# matched to its question through question_index; malformed JSON rows are skipped.
+_SQL_GET_SESSION_BLOOM_STATS = """
+    WITH graded AS (
+        SELECT s.results, q.quiz_data
+        FROM submissions s
+        JOIN quizzes q ON s.quiz_id = q.quiz_id
+        WHERE s.session_id = ? AND json_valid(s.results) AND json_valid(q.quiz_data)
+    )
+    SELECT COALESCE(json_extract(question.value, '$.bloom_level'), 'Understand') AS level,
+           COUNT(*) AS total,
+           SUM(CASE WHEN json_extract(result.value, '$.is_correct') THEN 1 ELSE 0 END) AS correct,
+           SUM(CASE WHEN json_extract(result.value, '$.time_taken') > 0
+                    THEN json_extract(result.value, '$.time_taken') ELSE 0 END) AS time_sum,
+           COUNT(CASE WHEN json_extract(result.value, '$.time_taken') > 0 THEN 1 END) AS time_count
+    FROM graded,
+         json_each(graded.results) AS result,
+         json_each(graded.quiz_data, '$.questions') AS question
+    WHERE question.key = json_extract(result.value, '$.question_index')
+    GROUP BY level
+"""
+# The latest score per session is one seek into idx_submissions_session(session_id, created_at DESC)
+# per session of this user; a grouped pass would aggregate every user's submissions
+_SQL_GET_USER_HISTORY = """
+    SELECT s.session_id, s.topics, s.image_path, s.created_at,
+           (SELECT score FROM submissions sub 
+            WHERE sub.session_id = s.session_id 
+            ORDER BY sub.created_at DESC LIMIT 1) as last_score
+    FROM sessions s
+    WHERE s.user_id = ?
+    ORDER BY s.created_at DESC
+"""
+
+
+# Max number of sessions whose performance stats are memoized
+_STATS_CACHE_SIZE = 1024
+
+# Read-only connections shared by the get_* methods (WAL lets them run concurrently)
+_READER_POOL_SIZE = 4
+
+# Bloom's levels that always appear in performance stats
+_STANDARD_LEVELS = ("Remember", "Understand", "Apply", "Analyze", "Evaluate", "Create")
+
+
+def _dumps(obj) -> str:
+    """Serialize to JSON text for the TEXT payload columns"""
+    # Bound as str, not bytes: a BLOB changes what json_each/json_extract see (newer SQLite
+    # reads BLOBs as JSONB), and decode("ascii") would fail on the unicode math in quizzes.
+    return orjson.dumps(obj).decode()
+
+
+def question_digest(text: str) -> bytes:
+    """16-byte digest of a question's text, ignoring case and whitespace differences"""
+    return hashlib.blake2b(" ".join(text.split()).casefold().encode(), digest_size=16).digest()
+
+
+def _question_hash_rows(session_id: str, quiz_data: Dict) -> List[Tuple[str, bytes]]:
+    """session_question_hashes rows for a quiz being saved"""
+    return [
+        (session_id, question_digest(q["question"]))
+        for q in quiz_data.get("questions", ())
+        if isinstance(q.get("question"), str)
+    ]
+
+
+def _parse_topics(data):
+    """Safely parse the JSON topics column (tolerates legacy encodings)"""
+    if not data:
+        return []
+    # Fast path: create_session always stores a canonical JSON array
+    if data[:1] == "[":
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return _parse_legacy_topics(data)
+
+
+def _parse_legacy_topics(data):
+    """Fallback schemes for topics written by older versions (double-encoded, Python list repr)"""
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        pass
+    try:
+        if isinstance(data, str) and (data.startswith('"') or data.startswith("'")):
+                return orjson.loads(orjson.loads(data))
+    except: pass
+    if str(data).startswith("[") and str(data).endswith("]"):
+            inner = str(data)[1:-1]
+            return [t.strip().strip("'").strip('"') for t in inner.split(",")]
+    return [str(data)]
 
 
 class Database:
     def __init__(self, db_path: str = "quiz_data.db"):
         self.db_path = db_path
+        # One long-lived connection per thread keeps SQLite's page cache warm between calls
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # Writers queue here instead of spinning in SQLite's busy handler; WAL readers never take it
+        self._write_lock = threading.Lock()
+        atexit.register(self._close_all)
+        # session_id -> (submission stamp, stats); LRU ordered, invalidated on new submissions
+        self._stats_cache: OrderedDict = OrderedDict()
+        self._stats_cache_lock = threading.Lock()
         self.init_db()
+        
+        # Readers are opened after init_db so the file (and its WAL) already exists
+        self._readers: queue.Queue = queue.Queue()
+        for _ in range(_READER_POOL_SIZE):
+            self._readers.put(self._open_reader())
+    
+    def _configure(self, conn: sqlite3.Connection):
+        """Apply row factory and per-connection PRAGMAs, and track it for shutdown"""
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")  # ~64MB
+        conn.execute("PRAGMA mmap_size=268435456")  # 256MB
+        with self._connections_lock:
+            self._connections.append(conn)
     
     def get_connection(self):
-        return sqlite3.connect(self.db_path)
+        """Per-thread read-write connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+            # Per-connection settings; journal_mode=WAL is persisted in the file by init_db
+            conn.execute("PRAGMA synchronous=NORMAL")  # safe under WAL, no fsync per commit
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._configure(conn)
+            self._local.conn = conn
+        return conn
+    
+    def _open_reader(self) -> sqlite3.Connection:
+        uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        self._configure(conn)
+        return conn
+    
+    @contextmanager
+    def reader(self):
+        """Borrow a read-only connection from the pool and yield a cursor on it"""
+        conn = self._readers.get()
+        cursor = conn.cursor()
+        try:
+            yield cursor
+        finally:
+            # Closing the cursor resets its statement, ending the read snapshot before reuse
+            cursor.close()
+            self._readers.put(conn)
+    
+    def _close_all(self):
+        """Close every writer and pooled reader connection (registered with atexit)"""
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._connections.clear()
+    
+    @contextmanager
+    def transaction(self):
+        """Run a block of writes inside one BEGIN IMMEDIATE ... COMMIT (one fsync for the batch)"""
+        conn = self.get_connection()
+        with self._write_lock:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
     
     def init_db(self):
         """Initialize database tables"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # WAL lets readers run alongside a writer; the mode sticks to the db file
+        cursor.execute("PRAGMA journal_mode=WAL")
         
         # Users table
         cursor.execute("""
@@ -43,6 +294,7 @@ class Database:
                 extracted_text TEXT,
                 topics TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                status TEXT DEFAULT 'ready',
                 FOREIGN KEY (user_id) REFERENCES users(user_id)
             )
         """)
@@ -53,6 +305,15 @@ class Database:
         except sqlite3.OperationalError:
             # Column likely already exists
             pass
+        
+        # OCR runs after the upload returns; rows from before that are already 'ready'
+        try:
+            cursor.execute("ALTER TABLE sessions ADD COLUMN status TEXT DEFAULT 'ready'")
+        except sqlite3.OperationalError:
+            pass
+        # OCR jobs only live in the process that queued them, so a row still 'processing' at
+        # startup was interrupted by a restart; mark it failed so it can be retried
+        cursor.execute("UPDATE sessions SET status = 'failed' WHERE status = 'processing'")
 
         # Quizzes table
         cursor.execute("""
@@ -81,301 +342,258 @@ class Database:
             )
         """)
         
+        # Digests of every question asked per session, so repeat checks don't re-read quiz JSON.
+        # The primary key doubles as the per-session index.
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'session_question_hashes'")
+        hashes_exist = cursor.fetchone() is not None
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS session_question_hashes (
+                session_id TEXT,
+                hash BLOB,
+                PRIMARY KEY (session_id, hash)
+            ) WITHOUT ROWID
+        """)
+        if not hashes_exist:
+            # First run against an existing database: hash the questions already stored
+            cursor.execute(_SQL_GET_ALL_QUESTIONS)
+            rows = [(session_id, question_digest(text)) for session_id, text in cursor.fetchall()]
+            cursor.executemany(_SQL_INSERT_QUESTION_HASH, rows)
+        
+        # Indices for the per-session / per-user lookups (newest first)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_email_cover ON users(email, user_id, username, hashed_password, created_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id, created_at DESC)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_quizzes_session ON quizzes(session_id, created_at DESC)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_session ON submissions(session_id, created_at DESC)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_quiz ON submissions(quiz_id)")
+        
+        conn.commit()
+        
+        # Refresh planner statistics so the indices above get picked
+        cursor.execute("ANALYZE")
         conn.commit()
-        conn.close()
 
     def create_user(self, email: str, username: str, hashed_password: str) -> str:
         """Create a new user"""
-        user_id = str(uuid.uuid4())
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        user_id = secrets.token_hex(16)
         
         try:
-            cursor.execute("""
-                INSERT INTO users (user_id, email, username, hashed_password)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, email, username, hashed_password))
-            conn.commit()
+            with self.transaction() as cursor:
+                cursor.execute(_SQL_INSERT_USER, (user_id, email, username, hashed_password))
             return user_id
         except sqlite3.IntegrityError:
             raise ValueError("Email already exists")
-        finally:
-            conn.close()
 
     def get_user_by_email(self, email: str) -> Optional[Dict]:
         """Get user by email"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute(_SQL_GET_USER_BY_EMAIL, (email,))
+            row = cursor.fetchone()
         
         if not row:
             return None
-            
+        
+        user_id, username, hashed_password, created_at = row
         return {
-            "user_id": row[0],
-            "email": row[1],
-            "username": row[2],
-            "hashed_password": row[3],
-            "created_at": row[4]
+            "user_id": user_id,
+            "email": email,
+            "username": username,
+            "hashed_password": hashed_password,
+            "created_at": created_at
         }
     
-    def create_session(self, user_id: str, image_path: str, extracted_text: str, topics: List[str]) -> str:
+    def create_session(self, user_id: str, image_path: str, extracted_text: str, topics: List[str], status: str = "ready") -> str:
         """Create a new session (linked to user)"""
-        session_id = str(uuid.uuid4())
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO sessions (session_id, user_id, image_path, extracted_text, topics)
-            VALUES (?, ?, ?, ?, ?)
-        """, (session_id, user_id, image_path, extracted_text, json.dumps(topics)))
+        session_id = secrets.token_hex(16)
+        row = (session_id, user_id, image_path, extracted_text, _dumps(topics), status)
         
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute(_SQL_INSERT_SESSION, row)
         return session_id
     
+    def update_session_topics(self, session_id: str, extracted_text: str, topics: List[str], status: str = "ready"):
+        """Store OCR output for a session created while it was still processing"""
+        row = (extracted_text, _dumps(topics), status, session_id)
+        
+        with self.transaction() as cursor:
+            cursor.execute(_SQL_UPDATE_SESSION_TOPICS, row)
+        # Topic performance in the stats is keyed by the session's topics
+        self._invalidate_stats(session_id)
+    
+    def retry_session(self, session_id: str) -> bool:
+        """Put a failed session back to 'processing'; False if it wasn't failed"""
+        with self.transaction() as cursor:
+            cursor.execute(_SQL_RETRY_SESSION, (session_id,))
+            return cursor.rowcount == 1
+    
     def get_session(self, session_id: str) -> Optional[Dict]:
         """Get session data"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute(_SQL_GET_SESSION, (session_id,))
+            row = cursor.fetchone()
         
         if not row:
             return None
-            
-        # Dynamically map indices to column names to handle schema variations (Fresh vs Migrated)
-        col_names = [description[0] for description in cursor.description]
-        row_dict = dict(zip(col_names, row))
-        
-        # Helper to safely parse JSON topics
-        def parse_topics(data):
-            if not data:
-                return []
-            try:
-                return json.loads(data)
-            except json.JSONDecodeError:
-                # Fallback schemes
-                try:
-                    if isinstance(data, str) and (data.startswith('"') or data.startswith("'")):
-                            return json.loads(json.loads(data))
-                except: pass
-                if str(data).startswith("[") and str(data).endswith("]"):
-                        inner = str(data)[1:-1]
-                        return [t.strip().strip("'").strip('"') for t in inner.split(",")]
-                return [str(data)]
-
+        
+        # user_id is None for sessions created before the column was added
+        sid, uid, image_path, extracted_text, topics, created_at, status = row
         return {
-            "session_id": row_dict.get("session_id"),
-            "user_id": row_dict.get("user_id"), # Will be None if column doesn't exist (old schema)
-            "image_path": row_dict.get("image_path"),
-            "extracted_text": row_dict.get("extracted_text"),
-            "topics": parse_topics(row_dict.get("topics")),
-            "created_at": row_dict.get("created_at")
+            "session_id": sid,
+            "user_id": uid,
+            "image_path": image_path,
+            "extracted_text": extracted_text,
+            "topics": _parse_topics(topics),
+            "created_at": created_at,
+            "status": status or "ready"
         }
 
     
     def save_quiz(self, session_id: str, quiz_data: Dict, quiz_type: str) -> str:
         """Save quiz to database"""
-        quiz_id = str(uuid.uuid4())
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO quizzes (quiz_id, session_id, quiz_data, quiz_type, difficulty)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
+        quiz_id = secrets.token_hex(16)
+        # Serialize before taking the write lock so the transaction only runs the insert
+        row = (
             quiz_id,
             session_id,
-            json.dumps(quiz_data),
+            _dumps(quiz_data),
             quiz_type,
             quiz_data.get("difficulty", "medium")
-        ))
+        )
         
-        conn.commit()
-        conn.close()
+        hash_rows = _question_hash_rows(session_id, quiz_data)
+        
+        with self.transaction() as cursor:
+            cursor.execute(_SQL_INSERT_QUIZ, row)
+            cursor.executemany(_SQL_INSERT_QUESTION_HASH, hash_rows)
         return quiz_id
     
     def get_quiz(self, quiz_id: str) -> Optional[Dict]:
         """Get quiz data"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT quiz_data FROM quizzes WHERE quiz_id = ?", (quiz_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute(_SQL_GET_QUIZ, (quiz_id,))
+            row = cursor.fetchone()
         
         if not row:
             return None
         
-        return json.loads(row[0])
+        return orjson.loads(row[0])
     
     def save_submission(self, quiz_id: str, session_id: str, score: float, results: List[Dict]):
         """Save quiz submission"""
-        submission_id = str(uuid.uuid4())
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO submissions (submission_id, quiz_id, session_id, score, results)
-            VALUES (?, ?, ?, ?, ?)
-        """, (submission_id, quiz_id, session_id, score, json.dumps(results)))
+        submission_id = secrets.token_hex(16)
+        row = (submission_id, quiz_id, session_id, score, _dumps(results))
         
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute(_SQL_INSERT_SUBMISSION, row)
+        self._invalidate_stats(session_id)
         return submission_id
     
+    def bulk_save_quizzes(self, quizzes: List[tuple]) -> List[str]:
+        """Save many (session_id, quiz_data, quiz_type) quizzes in a single transaction"""
+        # Build every id and JSON blob up front so the transaction only runs the inserts
+        rows = [
+            (secrets.token_hex(16), session_id, _dumps(quiz_data), quiz_type, quiz_data.get("difficulty", "medium"))
+            for session_id, quiz_data, quiz_type in quizzes
+        ]
+        hash_rows = [
+            hash_row
+            for session_id, quiz_data, _ in quizzes
+            for hash_row in _question_hash_rows(session_id, quiz_data)
+        ]
+        with self.transaction() as cursor:
+            cursor.executemany(_SQL_INSERT_QUIZ, rows)
+            cursor.executemany(_SQL_INSERT_QUESTION_HASH, hash_rows)
+        return [row[0] for row in rows]
+    
+    def bulk_save_submissions(self, submissions: List[tuple]) -> List[str]:
+        """Save many (quiz_id, session_id, score, results) submissions in a single transaction"""
+        rows = [
+            (secrets.token_hex(16), quiz_id, session_id, score, _dumps(results))
+            for quiz_id, session_id, score, results in submissions
+        ]
+        with self.transaction() as cursor:
+            cursor.executemany(_SQL_INSERT_SUBMISSION, rows)
+        for session_id in {row[2] for row in rows}:
+            self._invalidate_stats(session_id)
+        return [row[0] for row in rows]
+    
+    def get_last_stats(self, session_id: str) -> Tuple[float, Optional[str]]:
+        """Get (last quiz score, last generated quiz difficulty) for a session in one query"""
+        with self.reader() as cursor:
+            cursor.execute(_SQL_GET_LAST_STATS, (session_id,))
+            score, difficulty = cursor.fetchone()
+        
+        # Default to 50% if no previous score
+        return (score if score is not None else 50.0), difficulty
+    
     def get_last_score(self, session_id: str) -> float:
         """Get last quiz score for a session"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT score FROM submissions 
-            WHERE session_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT 1
-        """, (session_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        return row[0] if row else 50.0  # Default to 50% if no previous score
+        return self.get_last_stats(session_id)[0]
     
     def get_last_quiz_difficulty(self, session_id: str) -> Optional[str]:
         """Get the difficulty of the last generated quiz for a session"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT difficulty FROM quizzes 
-            WHERE session_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT 1
-        """, (session_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        return row[0] if row else None
+        return self.get_last_stats(session_id)[1]
         
     def get_all_questions_for_session(self, session_id: str) -> List[str]:
         """Get all question texts previously generated for this session"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT quiz_data FROM quizzes WHERE session_id = ?", (session_id,))
-        rows = cursor.fetchall()
-        
-        questions = []
-        for row in rows:
-            try:
-                quiz_data = json.loads(row[0])
-                for q in quiz_data.get("questions", []):
-                    questions.append(q["question"])
-            except:
-                pass
-                
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute(_SQL_GET_SESSION_QUESTIONS, (session_id,))
+            return [row[0] for row in cursor]
+    
+    def get_recent_questions_for_session(self, session_id: str, limit: int) -> List[str]:
+        """Texts of the last `limit` questions generated for this session, oldest first"""
+        with self.reader() as cursor:
+            cursor.execute(_SQL_GET_RECENT_SESSION_QUESTIONS, (session_id, limit))
+            questions = [row[0] for row in cursor]
+        questions.reverse()
         return questions
     
+    def get_question_hashes(self, session_id: str) -> frozenset:
+        """question_digest of every question generated for this session"""
+        with self.reader() as cursor:
+            cursor.execute(_SQL_GET_QUESTION_HASHES, (session_id,))
+            return frozenset(row[0] for row in cursor)
+    
+    def _invalidate_stats(self, session_id: str):
+        """Drop memoized performance stats for a session"""
+        with self._stats_cache_lock:
+            self._stats_cache.pop(session_id, None)
+    
     def get_performance_stats(self, session_id: str) -> Optional[Dict]:
-        """Get performance statistics for a session"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Get all submissions linked to this session
-        cursor.execute("""
-            SELECT s.score, s.created_at, s.results, q.quiz_data 
-            FROM submissions s
-            JOIN quizzes q ON s.quiz_id = q.quiz_id
-            WHERE s.session_id = ? 
-            ORDER BY s.created_at
-        """, (session_id,))
-        
-        rows = cursor.fetchall()
-        
-        if not rows:
-            conn.close()
-            return None
+        """Get performance statistics for a session (memoized until its submissions change)"""
+        with self.reader() as cursor:
+            # Stats only change when a submission lands, so (latest timestamp, count) versions them
+            cursor.execute(_SQL_GET_SESSION_SUBMISSION_STAMP, (session_id,))
+            stamp = tuple(cursor.fetchone())
+            with self._stats_cache_lock:
+                cached = self._stats_cache.get(session_id)
+                if cached and cached[0] == stamp:
+                    self._stats_cache.move_to_end(session_id)
+                    return cached[1]
+            
+            # Get all submissions linked to this session
+            cursor.execute(_SQL_GET_SESSION_SUBMISSIONS, (session_id,))
+            rows = cursor.fetchall()
+            
+            if not rows:
+                return None
+            
+            # One row per level; time is averaged over questions that recorded any (old data has none)
+            cursor.execute(_SQL_GET_SESSION_BLOOM_STATS, (session_id,))
+            level_rows = cursor.fetchall()
         
         scores = [row[0] for row in rows]
         average_score = sum(scores) / len(scores)
         
-        # Calculate Bloom's Performance (Accuracy & Time)
-        bloom_counts = {}   # {level: total_questions}
-        bloom_correct = {}  # {level: correct_answers}
-        bloom_time_sum = {} # {level: total_seconds_spent}
-        bloom_time_count = {} # {level: count_of_timed_questions}
-        
-        # Initialize standard levels to ensure they appear
-        standard_levels = ["Remember", "Understand", "Apply", "Analyze", "Evaluate", "Create"]
-        for level in standard_levels:
-            bloom_counts[level] = 0
-            bloom_correct[level] = 0
-            bloom_time_sum[level] = 0
-            bloom_time_count[level] = 0
-            
-        for row in rows:
-            try:
-                # row[2] is submission results (JSON), row[3] is quiz_data (JSON)
-                results = json.loads(row[2])
-                quiz = json.loads(row[3])
-                questions = quiz["questions"]
-                
-                # Create a map of question index to bloom level
-                q_bloom_map = {}
-                for i, q in enumerate(questions):
-                     q_bloom_map[i] = q.get("bloom_level", "Understand")
-                
-                for res in results:
-                    idx = res.get("question_index")
-                    is_correct = res.get("is_correct")
-                    time_taken = res.get("time_taken", 0) # Use 0 if missing (old data)
-                    
-                    if idx is not None and idx in q_bloom_map:
-                        level = q_bloom_map[idx]
-                        bloom_counts[level] = bloom_counts.get(level, 0) + 1
-                        if is_correct:
-                            bloom_correct[level] = bloom_correct.get(level, 0) + 1
-                            
-                        # Track time (all questions, or just correct? Usually all is useful for "effort")
-                        if time_taken > 0:
-                            bloom_time_sum[level] = bloom_time_sum.get(level, 0) + time_taken
-                            bloom_time_count[level] = bloom_time_count.get(level, 0) + 1
-                            
-            except Exception as e:
-                print(f"Error calculating stats for row: {e}")
-                continue
-                
-        # Calculate percentages & averages
-        bloom_performance = {}
-        bloom_time_performance = {}
-        
-        for level in bloom_counts:
-            # Accuracy
-            if bloom_counts[level] > 0:
-                bloom_performance[level] = (bloom_correct[level] / bloom_counts[level]) * 100
-            else:
-                bloom_performance[level] = 0.0
-            
-            # Average Time
-            if bloom_time_count[level] > 0:
-                bloom_time_performance[level] = bloom_time_sum[level] / bloom_time_count[level]
-            else:
-                bloom_time_performance[level] = 0.0
+        # Calculate Bloom's Performance (Accuracy & Time), standard levels always present
+        bloom_performance = dict.fromkeys(_STANDARD_LEVELS, 0.0)
+        bloom_time_performance = dict.fromkeys(_STANDARD_LEVELS, 0.0)
+        
+        for level, total, correct, time_sum, time_count in level_rows:
+            bloom_performance[level] = (correct / total) * 100 if total else 0.0
+            bloom_time_performance[level] = time_sum / time_count if time_count else 0.0
 
-        # Get session topics
-        session = self.get_session(session_id)
-        if session and "topics" in session:
-            topics = session["topics"]
-        else:
-            topics = []
+        # Session topics ride along on every row; parse them once
+        topics = _parse_topics(rows[0]["topics"])
         
         # Calculate topic performance (simplified - average score per topic)
         topic_performance = {topic: average_score for topic in topics}
@@ -390,9 +608,7 @@ class Database:
             for i, row in enumerate(rows)
         ]
         
-        conn.close()
-        
-        return {
+        stats = {
             "session_id": session_id,
             "total_quizzes": len(rows),
             "average_score": average_score,
@@ -401,31 +617,27 @@ class Database:
             "bloom_time_performance": bloom_time_performance,
             "quiz_history": quiz_history
         }
+        
+        with self._stats_cache_lock:
+            self._stats_cache[session_id] = (stamp, stats)
+            self._stats_cache.move_to_end(session_id)
+            if len(self._stats_cache) > _STATS_CACHE_SIZE:
+                self._stats_cache.popitem(last=False)
+        
+        return stats
 
     def get_user_history(self, user_id: str) -> List[Dict]:
         """Get all sessions/quizzes for a user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         # Get sessions with their image paths and last quiz score
-        cursor.execute("""
-            SELECT s.session_id, s.topics, s.image_path, s.created_at,
-                   (SELECT score FROM submissions sub 
-                    WHERE sub.session_id = s.session_id 
-                    ORDER BY sub.created_at DESC LIMIT 1) as last_score
-            FROM sessions s
-            WHERE s.user_id = ?
-            ORDER BY s.created_at DESC
-        """, (user_id,))
-        
-        rows = cursor.fetchall()
-        conn.close()
+        with self.reader() as cursor:
+            cursor.execute(_SQL_GET_USER_HISTORY, (user_id,))
+            rows = cursor.fetchall()
         
         history = []
         for row in rows:
             # Map absolute path back to relative path for serving
             # Assuming 'uploads' is always in the path
-            image_path = row[2]
+            image_path = row["image_path"]
             relative_image_path = None
             if image_path:
                 try:
@@ -438,10 +650,10 @@ class Database:
                     pass
 
             history.append({
-                "session_id": row[0],
-                "topics": json.loads(row[1]) if row[1] else [],
+                "session_id": row["session_id"],
+                "topics": _parse_topics(row["topics"]),
                 "image_path": relative_image_path,
-                "last_score": row[4], # Can be None
-                "created_at": row[3]
+                "last_score": row["last_score"], # Can be None
+                "created_at": row["created_at"]
             })
         return history
@@ -1,6 +1,8 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, BackgroundTasks, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -10,12 +12,14 @@ os.environ["GRPC_DNS_RESOLVER"] = "native"
 
 load_dotenv(dotenv_path=Path(__file__).parent / ".env")
 import shutil
+import asyncio
 from typing import List, Dict, Optional
 import json
 from datetime import datetime
 
 from services.ocr_service import OCRService
-from services.quiz_generator import QuizGenerator
+from services.quiz_generator import QuizGenerator, PROMPT_HISTORY_SIZE
+from services.quiz_cache import QuizCache
 from services.adaptive_quiz import AdaptiveQuizService
 from services.auth import verify_password, get_password_hash, create_access_token, get_current_user_id
 from database.database import Database
@@ -25,7 +29,8 @@ from models.schemas import (
     PerformanceStats, UserCreate, UserLogin, Token
 )
 
-app = FastAPI(title="SocratAI API")
+# Responses are encoded with orjson instead of the stdlib json module
+app = FastAPI(title="SocratAI API", default_response_class=ORJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -36,14 +41,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+class APIGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that passes /uploads through untouched (the images are already compressed)"""
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/uploads/"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# Quiz, stats and history payloads are repetitive JSON; tiny responses aren't worth compressing
+app.add_middleware(APIGZipMiddleware, minimum_size=512)
+
+DB_PATH = str(Path(__file__).parent / "quiz_data.db")
+
 # Initialize services (OCR is lazy-loaded to avoid SSL issues at startup)
 ocr_service = OCRService()
-quiz_generator = QuizGenerator()
+quiz_generator = QuizGenerator(cache=QuizCache(db_path=DB_PATH))
 adaptive_service = AdaptiveQuizService()
-db = Database(db_path=str(Path(__file__).parent / "quiz_data.db"))
+db = Database(db_path=DB_PATH)
 
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
+# Copy uploads in 1 MiB chunks rather than shutil's 64 KiB default
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# One OCR job at a time, like when it ran inline; the reader is large and CPU-bound
+ocr_lock = asyncio.Lock()
 
 from fastapi.staticfiles import StaticFiles
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
@@ -59,7 +84,8 @@ async def signup(user: UserCreate):
             detail="Email already registered"
         )
     
-    hashed_password = get_password_hash(user.password)
+    # Hashing is deliberately CPU-heavy; run it off the event loop so other requests keep flowing
+    hashed_password = await run_in_threadpool(get_password_hash, user.password)
     try:
         user_id = db.create_user(user.email, user.username, hashed_password)
         
@@ -79,7 +105,7 @@ async def login(user_credentials: UserLogin): # Using JSON body instead of OAuth
             detail="Incorrect email or password",
         )
     
-    if not verify_password(user_credentials.password, user["hashed_password"]):
+    if not await run_in_threadpool(verify_password, user_credentials.password, user["hashed_password"]):
          raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -95,33 +121,73 @@ async def get_history(user_id: str = Depends(get_current_user_id)):
     return db.get_user_history(user_id)
 
 
+def _run_ocr(image_path: str):
+    """Extract text and topics from an uploaded image (blocking)"""
+    extracted_text = ocr_service.extract_text(image_path)
+    return extracted_text, ocr_service.extract_topics(extracted_text)
+
+
+async def _process_upload(session_id: str, image_path: str):
+    """Background job: OCR the upload and fill in the session's topics"""
+    try:
+        async with ocr_lock:
+            extracted_text, topics = await asyncio.to_thread(_run_ocr, image_path)
+        await asyncio.to_thread(db.update_session_topics, session_id, extracted_text, topics)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"ERROR processing upload {session_id}: {e}")
+        await asyncio.to_thread(db.update_session_topics, session_id, "", [], "failed")
+
+
 @app.post("/api/upload", response_model=UploadResponse)
-async def upload_image(file: UploadFile = File(...), user_id: str = Depends(get_current_user_id)):
-    """Upload syllabus image and extract topics"""
+async def upload_image(background_tasks: BackgroundTasks, file: UploadFile = File(...), user_id: str = Depends(get_current_user_id)):
+    """Upload syllabus image; topics are extracted in the background (poll /api/topics)"""
     try:
         # Save uploaded file
         file_path = UPLOAD_DIR / f"{user_id}_{file.filename}" # Prefix with user_id to avoid collisions
         with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Extract text using OCR
-        extracted_text = ocr_service.extract_text(str(file_path))
+            shutil.copyfileobj(file.file, buffer, length=UPLOAD_CHUNK_SIZE)
         
-        # Extract topics
-        topics = ocr_service.extract_topics(extracted_text)
-        
-        # Store in database
-        session_id = db.create_session(user_id, str(file_path), extracted_text, topics)
+        # Store in database now, OCR fills in text and topics after the response is sent
+        session_id = db.create_session(user_id, str(file_path), "", [], status="processing")
+        background_tasks.add_task(_process_upload, session_id, str(file_path))
         
         return UploadResponse(
             session_id=session_id,
-            message="Image uploaded successfully",
-            topics=topics
+            message="Processing",
+            topics=[],
+            status="processing"
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/retry-topics/{session_id}", response_model=UploadResponse)
+async def retry_topics(session_id: str, background_tasks: BackgroundTasks, user_id: str = Depends(get_current_user_id)):
+    """Run topic extraction again for a session whose OCR failed or was interrupted"""
+    session = db.get_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    if session.get("user_id") != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this session")
+    
+    if not os.path.exists(session["image_path"]):
+        raise HTTPException(status_code=410, detail="The uploaded image is gone. Please upload it again")
+    
+    if not db.retry_session(session_id):
+        raise HTTPException(status_code=409, detail="Topic extraction has not failed for this session")
+    background_tasks.add_task(_process_upload, session_id, session["image_path"])
+    
+    return UploadResponse(
+        session_id=session_id,
+        message="Processing",
+        topics=[],
+        status="processing"
+    )
+
+
 @app.get("/api/topics/{session_id}", response_model=TopicListResponse)
 async def get_topics(session_id: str, user_id: str = Depends(get_current_user_id)):
     """Get topics for a session"""
@@ -133,29 +199,35 @@ async def get_topics(session_id: str, user_id: str = Depends(get_current_user_id
     if session.get("user_id") != user_id:
         raise HTTPException(status_code=403, detail="Not authorized to access this session")
     
-    return TopicListResponse(topics=session["topics"])
+    return TopicListResponse(topics=session["topics"], status=session["status"])
 
 
 @app.post("/api/generate-quiz", response_model=QuizResponse)
 async def generate_quiz(request: QuizRequest, user_id: str = Depends(get_current_user_id)):
     """Generate initial quiz based on topics"""
     try:
-        session = db.get_session(request.session_id)
+        # SQLite calls go through the threadpool so they don't stall other requests
+        session = await run_in_threadpool(db.get_session, request.session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
             
         if session.get("user_id") != user_id:
             raise HTTPException(status_code=403, detail="Not authorized")
         
+        if session["status"] == "processing":
+            raise HTTPException(status_code=409, detail="Topics are still being extracted")
+        if session["status"] == "failed":
+            raise HTTPException(status_code=409, detail="Topic extraction failed. Retry it or upload the image again")
+        
         # Generate quiz
-        quiz = quiz_generator.generate_quiz(
+        quiz = await quiz_generator.generate_quiz(
             topics=session["topics"],
             num_questions=request.num_questions or 18,
             difficulty="easy"
         )
         
         # Store quiz in database
-        quiz_id = db.save_quiz(request.session_id, quiz, "initial")
+        quiz_id = await run_in_threadpool(db.save_quiz, request.session_id, quiz, "initial")
         
         return QuizResponse(
             quiz_id=quiz_id,
@@ -189,37 +261,32 @@ async def submit_quiz(submission: QuizSubmission, user_id: str = Depends(get_cur
             raise HTTPException(status_code=404, detail="Quiz not found")
         
         # Calculate stats
-        correct = 0
-        total = len(quiz["questions"])
-        results = []
-        total_time_correct = 0
-        correct_count_for_time = 0
+        questions = quiz["questions"]
+        total = len(questions)
         
-        for i, question in enumerate(quiz["questions"]):
-            q_idx_str = str(i)
-            user_answer = submission.answers.get(q_idx_str)
-            correct_answer = question["correct_answer"]
-            is_correct = user_answer == correct_answer
-            
-            # Extract time for this question
-            time_spent = 0
-            if submission.time_taken:
-                # Keys in time_taken might be integers (from frontend) or strings (restored from JSON)
-                # Pydantic model defines it as Dict[int, float], so keys should be ints.
-                time_spent = submission.time_taken.get(i, 0)
-            
-            if is_correct:
-                correct += 1
-                total_time_correct += time_spent
-                correct_count_for_time += 1
-            
-            results.append({
+        # Bind the lookups once instead of re-resolving the model attributes per question
+        get_answer = submission.answers.get
+        # Keys in time_taken might be integers (from frontend) or strings (restored from JSON)
+        # Pydantic model defines it as Dict[int, float], so keys should be ints.
+        get_time = (submission.time_taken or {}).get
+        
+        user_answers = [get_answer(str(i)) for i in range(total)]
+        # Plain dicts: they're persisted as-is and the response model validates them once
+        results = [
+            {
                 "question_index": i,
                 "user_answer": user_answer,
-                "correct_answer": correct_answer,
-                "is_correct": is_correct,
-                "time_taken": time_spent # Store in DB
-            })
+                "correct_answer": question["correct_answer"],
+                "is_correct": user_answer == question["correct_answer"],
+                "time_taken": get_time(i, 0) # Store in DB
+            }
+            for i, (question, user_answer) in enumerate(zip(questions, user_answers))
+        ]
+        
+        correct_times = [r["time_taken"] for r in results if r["is_correct"]]
+        correct = len(correct_times)
+        total_time_correct = sum(correct_times)
+        correct_count_for_time = correct
         
         score_percentage = (correct / total) * 100
         avg_time_correct = (total_time_correct / correct_count_for_time) if correct_count_for_time > 0 else 0
@@ -275,15 +342,21 @@ async def submit_quiz(submission: QuizSubmission, user_id: str = Depends(get_cur
 async def generate_adaptive_quiz(request: QuizRequest, user_id: str = Depends(get_current_user_id)):
     """Generate adaptive quiz based on previous performance"""
     try:
-        session = db.get_session(request.session_id)
+        # SQLite calls go through the threadpool so they don't stall other requests
+        session = await run_in_threadpool(db.get_session, request.session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
         
         if session.get("user_id") != user_id:
             raise HTTPException(status_code=403, detail="Not authorized")
+        
+        if session["status"] == "processing":
+            raise HTTPException(status_code=409, detail="Topics are still being extracted")
+        if session["status"] == "failed":
+            raise HTTPException(status_code=409, detail="Topic extraction failed. Retry it or upload the image again")
             
-        # Get previous quiz performance
-        previous_score = db.get_last_score(request.session_id)
+        # Get previous quiz performance and the last quiz's difficulty in one lookup
+        previous_score, last_difficulty = await run_in_threadpool(db.get_last_stats, request.session_id)
         
         # Get previous quiz to determine its difficulty
         # Ideally we store difficulty in submissions or get the last quiz directly
@@ -299,7 +372,7 @@ async def generate_adaptive_quiz(request: QuizRequest, user_id: str = Depends(ge
         # BUT the user specifically requested smooth transitions.
         # So let's implement get_last_quiz_difficulty in DB or just peek at recent history.
         
-        last_difficulty = db.get_last_quiz_difficulty(request.session_id) or "easy" # Default to easy if first adaptive
+        last_difficulty = last_difficulty or "easy" # Default to easy if first adaptive
         
         if previous_score < 60:
              difficulty = "easy" if last_difficulty == "medium" else "medium" if last_difficulty == "hard" else "easy"
@@ -308,25 +381,32 @@ async def generate_adaptive_quiz(request: QuizRequest, user_id: str = Depends(ge
         else:
              difficulty = last_difficulty
         
-        # Get all previous questions for this session to avoid repetition
-        previous_questions = db.get_all_questions_for_session(request.session_id)
+        # Previous questions for this session to avoid repetition: digests of all of them for
+        # filtering, full text only for the recent ones quoted in the prompt
+        previous_questions = await run_in_threadpool(
+            db.get_recent_questions_for_session, request.session_id, PROMPT_HISTORY_SIZE
+        )
+        previous_hashes = await run_in_threadpool(db.get_question_hashes, request.session_id)
         
         # Generate adaptive quiz
-        quiz = quiz_generator.generate_quiz(
+        quiz = await quiz_generator.generate_quiz(
             topics=session["topics"],
             num_questions=request.num_questions or 18,
             difficulty=difficulty,
-            previous_questions=previous_questions
+            previous_questions=previous_questions,
+            previous_hashes=previous_hashes
         )
         
         # Store quiz
-        quiz_id = db.save_quiz(request.session_id, quiz, f"adaptive_{difficulty}")
+        quiz_id = await run_in_threadpool(db.save_quiz, request.session_id, quiz, f"adaptive_{difficulty}")
         
         return QuizResponse(
             quiz_id=quiz_id,
             questions=quiz["questions"],
             session_id=request.session_id
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -6,10 +6,12 @@ class UploadResponse(BaseModel):
     session_id: str
     message: str
     topics: List[str]
+    status: str = "ready" # "processing" until OCR finishes, then "ready" or "failed"
 
 
 class TopicListResponse(BaseModel):
     topics: List[str]
+    status: str = "ready"
 
 
 class QuizRequest(BaseModel):
@@ -21,6 +23,7 @@ class Question(BaseModel):
     question: str
     options: List[str]
     correct_answer: int
+    bloom_level: str = "Understand"
 
 
 class QuizResponse(BaseModel):
@@ -1,4 +1,5 @@
 import easyocr
+import cv2
 import re
 from typing import List, Optional
 import os
@@ -11,6 +12,16 @@ if not hasattr(PIL.Image, 'ANTIALIAS'):
     PIL.Image.ANTIALIAS = PIL.Image.LANCZOS
 
 class OCRService:
+    # Longest image side (px) handed to the detector; bigger scans are downscaled first
+    MAX_IMAGE_SIDE = 2000
+
+    # Line-splitting patterns and word sets for extract_topics, compiled/built once
+    _COLUMN_GAP_RE = re.compile(r'\s{3,}')  # 3+ spaces (common in columns)
+    _MERGED_TITLE_RE = re.compile(r'(?<=[a-z])\s+(?=[A-Z][a-z])')  # lowercase, spaces, Capitalized word
+    _CONNECTORS = frozenset({'of', 'a', 'an', 'the', 'and', 'or', 'for', 'to', 'in', 'with', 'by', 'using'})
+    _GENERIC_WORDS = frozenset({'matrix', 'formula', 'introduction'})
+    _BAD_STARTS = frozenset({'how to', 'methods to', 'types of', 'properties of'})
+
     def __init__(self):
         # Lazy initialization - only initialize when needed
         print("OCR service ready (will initialize on first use)")
@@ -33,7 +44,10 @@ class OCRService:
             ssl._create_default_https_context = ssl._create_unverified_context
             
             try:
-                self.reader = easyocr.Reader(['en'], gpu=False)
+                # quantize=True is EasyOCR's default, spelled out because the CPU path relies on it:
+                # torch dynamic int8 quantization of nn.Linear/nn.LSTM, so only the recognizer is
+                # affected (the CRAFT detector is all convolutions and stays float)
+                self.reader = easyocr.Reader(['en'], gpu=False, quantize=True)
             finally:
                 # Restore original SSL context
                 ssl._create_default_https_context = original_context
@@ -51,6 +65,21 @@ class OCRService:
             self.reader = None
             self._initialized = True  # Mark as attempted to avoid retrying
     
+    def _preprocess(self, image_path: str):
+        """Grayscale, downscale and binarize with OpenCV before OCR"""
+        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            # Unreadable by OpenCV, let EasyOCR handle the raw file
+            return image_path
+        
+        h, w = img.shape[:2]
+        if max(h, w) > self.MAX_IMAGE_SIDE:
+            scale = self.MAX_IMAGE_SIDE / max(h, w)
+            img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        
+        # Adaptive threshold copes with uneven lighting on photographed pages
+        return cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 31, 10)
+    
     def extract_text(self, image_path: str) -> str:
         """Extract text from image using OCR"""
         self._initialize_reader()
@@ -67,13 +96,16 @@ class OCRService:
             # mag_ratio=1.5 helps with small text
             # contrast_ths=0.1 helps with low contrast
             # adjust_contrast=0.5 helps with legibility
+            # batch_size=8 runs the recognizer on batches of detected regions
+            image = self._preprocess(image_path)
             results = self.reader.readtext(
-                image_path, 
+                image, 
                 detail=0, 
                 paragraph=True,
                 mag_ratio=1.5,
                 contrast_ths=0.1,
-                adjust_contrast=0.5
+                adjust_contrast=0.5,
+                batch_size=8
             )
             
             # Combine all detected text with newlines to preserve structure
@@ -92,29 +124,24 @@ class OCRService:
             traceback.print_exc()
             return ""
     
+    def _is_topic(self, line: str) -> bool:
+        """Title-like line check applied to each candidate in extract_topics"""
+        # Length bounds, and must start with letter/digit
+        if not (5 < len(line) < 100) or not line[0].isalnum():
+            return False
+        # If it's not a sentence (doesn't end in .) or it's a short "sentence" acting as title
+        if line.endswith('.') and len(line) >= 60:
+            return False
+        lowered = line.lower()
+        # Skip generic single words if they likely belong to a fuller title
+        if lowered in self._GENERIC_WORDS and len(line.split()) < 2:
+            return False
+        # Filter out "topics" that are just verbs/connectors
+        return lowered not in self._BAD_STARTS
+    
     def extract_topics(self, text: str) -> List[str]:
         """Extract topics from extracted text"""
-        topics = []
-        
-        # Common patterns for syllabus topics
-        # Look for numbered lists, bullet points, chapter titles, etc.
-        
-        # Pattern 1: Numbered topics (1., 2., etc.)
-        numbered_pattern = r'\d+[\.\)]\s*([A-Z][^\n]+)'
-        matches = re.findall(numbered_pattern, text)
-        topics.extend([m.strip() for m in matches])
-        
-        # Pattern 2: Bullet points (-, *, •)
-        bullet_pattern = r'[-*•]\s*([A-Z][^\n]+)'
-        matches = re.findall(bullet_pattern, text)
-        topics.extend([m.strip() for m in matches])
-        
-        # Pattern 3: Chapter/Unit titles (Chapter X:, Unit X:, etc.)
-        chapter_pattern = r'(?:Chapter|Unit|Topic|Module)\s*\d*[:\-]?\s*([A-Z][^\n]+)'
-        matches = re.findall(chapter_pattern, text, re.IGNORECASE)
-        topics.extend([m.strip() for m in matches])
-        
-        # Pattern 4: Lines starting with capital letters (potential titles)
+        # Lines starting with capital letters (potential titles)
         # Relaxed logic: Accept almost any line that looks like a title
         # Also handle merged titles (e.g. "Matrix Properties of Determinants Determinant of a Matrix")
         
@@ -135,12 +162,12 @@ class OCRService:
             temp_parts = []
             
             # Split by 3+ spaces (common in columns)
-            cols = re.split(r'\s{3,}', r_line)
+            cols = self._COLUMN_GAP_RE.split(r_line)
             for col in cols:
                 if len(col) > 60:
                      # Look for: (lowercase letter) (spaces) (Capital Letter)
                      # limit split to avoid breaking sentences
-                     sub_parts = re.split(r'(?<=[a-z])\s+(?=[A-Z][a-z])', col)
+                     sub_parts = self._MERGED_TITLE_RE.split(col)
                      temp_parts.extend(sub_parts)
                 else:
                     temp_parts.append(col)
@@ -150,7 +177,7 @@ class OCRService:
             merged_parts = []
             if temp_parts:
                 current_part = temp_parts[0]
-                connectors = {'of', 'a', 'an', 'the', 'and', 'or', 'for', 'to', 'in', 'with', 'by', 'using'}
+                connectors = self._CONNECTORS
                 
                 for i in range(1, len(temp_parts)):
                     next_part = temp_parts[i]
@@ -168,34 +195,8 @@ class OCRService:
             else:
                 lines.append(r_line) # Just in case
 
-        topics = []
-        for line in lines:
-            line = line.strip()
-            # Filter incomplete fragments often caused by bad OCR or splitting
-            if len(line.split()) < 2 and line.lower() in {'matrix', 'formula', 'introduction'}:
-                 # Skip generic single words if they likely belong to a fuller title
-                 continue
-                 
-            if len(line) > 5 and len(line) < 100:
-                # Must start with letter, have some content
-                if line[0].isalnum():
-                    # If it's not a sentence (doesn't end in .) or it's a short "sentence" acting as title
-                    if not line.endswith('.') or len(line) < 60:
-                        topics.append(line)
-        
-        # Remove duplicates and clean
-        topics = list(set(topics))
-        topics = [t for t in topics if len(t) > 5 and len(t) < 100]
-        
-        # Filter out "topics" that are just verbs/connectors
-        bad_starts = {'how to', 'methods to', 'types of', 'properties of'}
-        final_topics = []
-        for t in topics:
-            if t.lower() in bad_starts:
-                continue
-            final_topics.append(t)
-            
-        topics = final_topics
+        # One pass over the unique lines (page order kept, so the [:20] cut keeps the earliest topics)
+        topics = [line for line in dict.fromkeys(l.strip() for l in lines) if self._is_topic(line)]
         
         # If no topics found, just use the raw lines
         if not topics:
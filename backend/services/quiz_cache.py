@@ -0,0 +1,168 @@
+import sqlite3
+import hashlib
+import threading
+import time
+import re
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import orjson
+
+# Entries kept in-process in front of the SQLite table
+_MEMORY_CACHE_SIZE = 256
+
+# Cached quizzes are served for a day, then regenerated. Past the soft TTL a hit is still served,
+# but flagged stale so the caller can refresh it in the background
+_DEFAULT_TTL = 86400
+_DEFAULT_SOFT_TTL = 72000
+
+# Quiz JSON is repetitive (keys, option phrasing); stored deflated, typically 3-4x smaller
+_COMPRESS_LEVEL = 6
+
+# Semantic lookup: topic lists are embedded as signed hashed bag-of-words vectors, and a miss on
+# the exact key can be served by a quiz whose topics are near-identical (cosine >= threshold)
+_EMBED_DIM = 512
+_SIMILARITY_THRESHOLD = 0.9
+_SEMANTIC_INDEX_SIZE = 1024
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_STOP_WORDS = frozenset({"a", "an", "the", "of", "in", "on", "and", "or", "for", "to", "with", "by", "its", "their"})
+
+
+def embed_topics(topics: List[str]) -> np.ndarray:
+    """Unit-length hashed bag-of-words vector for a topic list (word order and stop words ignored)"""
+    vec = np.zeros(_EMBED_DIM, dtype=np.float32)
+    for word in _WORD_RE.findall(" ".join(topics).lower()):
+        if word in _STOP_WORDS:
+            continue
+        h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+        # The top bit picks the sign so colliding words tend to cancel rather than inflate similarity
+        vec[h % _EMBED_DIM] += 1.0 if h >> 63 else -1.0
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class QuizCache:
+    """Persistent cache of generated quizzes keyed by their generation inputs"""
+
+    def __init__(self, db_path: str = "quiz_data.db", ttl: int = _DEFAULT_TTL, soft_ttl: int = _DEFAULT_SOFT_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.soft_ttl = soft_ttl
+        # key -> (compressed quiz, created_at epoch); LRU ordered. Serialized, so every hit hands out a fresh dict
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # In-process ring of embeddings for find_similar; slot i <-> (key, num_questions, difficulty)
+        self._vectors = np.zeros((_SEMANTIC_INDEX_SIZE, _EMBED_DIM), dtype=np.float32)
+        self._vector_meta: List[Optional[tuple]] = [None] * _SEMANTIC_INDEX_SIZE
+        # key -> its slot, so re-storing a key (e.g. a background refresh) reuses the slot
+        self._key_slots: Dict[bytes, int] = {}
+        self._next_slot = 0
+
+        # One shared connection, opened once with the PRAGMAs applied
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA cache_size=-32768")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS quiz_cache (
+                key BLOB PRIMARY KEY,
+                quiz BLOB,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # Expired rows (and keys from older key formats) are never read again
+        self._conn.execute("DELETE FROM quiz_cache WHERE created_at < datetime('now', ?)", (f"-{ttl} seconds",))
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(topics: List[str], num_questions: int, difficulty: str, previous_questions: List[str] = None) -> bytes:
+        """SHA-256 of everything that shapes the prompt (previous questions folded in for adaptive quizzes)"""
+        inputs = {
+            "topics": sorted(topics),
+            "num_questions": num_questions,
+            "difficulty": difficulty,
+            "previous_questions": list(previous_questions or ()),
+        }
+        return hashlib.sha256(orjson.dumps(inputs, option=orjson.OPT_SORT_KEYS)).digest()
+
+    def get(self, key: bytes) -> Optional[Dict]:
+        entry = self.lookup(key)
+        return entry[0] if entry else None
+
+    def lookup(self, key: bytes) -> Optional[Tuple[Dict, bool]]:
+        """Cached quiz and whether it's past the soft TTL (still served, but due for a refresh)"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            else:
+                row = self._conn.execute(
+                    "SELECT quiz, CAST(strftime('%s', created_at) AS INTEGER) FROM quiz_cache WHERE key = ?",
+                    (key,)
+                ).fetchone()
+                if not row:
+                    return None
+                entry = self._remember(key, row[0], row[1])
+            
+            payload, created_at = entry
+            age = time.time() - created_at
+            if age > self.ttl:
+                self._memory.pop(key, None)
+                return None
+        # Rows written before compression hold plain JSON text
+        return orjson.loads(zlib.decompress(payload) if isinstance(payload, bytes) else payload), age > self.soft_ttl
+
+    def set(self, key: bytes, quiz: Dict):
+        payload = zlib.compress(orjson.dumps(quiz), _COMPRESS_LEVEL)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO quiz_cache (key, quiz) VALUES (?, ?)", (key, payload))
+            self._conn.commit()
+            self._remember(key, payload, time.time())
+
+    def find_similar(self, topics: List[str], num_questions: int, difficulty: str) -> Optional[Tuple[Dict, bool]]:
+        """lookup() result for near-identical topics generated with the same settings, if any"""
+        query = embed_topics(topics)
+        if not query.any():
+            return None
+        
+        with self._lock:
+            settings = (num_questions, difficulty)
+            eligible = np.fromiter(
+                (meta is not None and meta[1:] == settings for meta in self._vector_meta),
+                dtype=bool, count=_SEMANTIC_INDEX_SIZE
+            )
+            if not eligible.any():
+                return None
+            # One matrix-vector product scores every indexed topic list
+            sims = np.where(eligible, self._vectors @ query, -1.0)
+            best = int(sims.argmax())
+            if sims[best] < _SIMILARITY_THRESHOLD:
+                return None
+            key = self._vector_meta[best][0]
+        # Through lookup() so the TTLs still apply
+        return self.lookup(key)
+
+    def index_topics(self, key: bytes, topics: List[str], num_questions: int, difficulty: str):
+        """Make a stored quiz findable by find_similar (a known key keeps its slot; else the oldest is overwritten)"""
+        vec = embed_topics(topics)
+        if not vec.any():
+            return
+        with self._lock:
+            slot = self._key_slots.get(key)
+            if slot is None:
+                slot = self._next_slot
+                self._next_slot = (slot + 1) % _SEMANTIC_INDEX_SIZE
+                evicted = self._vector_meta[slot]
+                if evicted is not None:
+                    del self._key_slots[evicted[0]]
+                self._key_slots[key] = slot
+            self._vectors[slot] = vec
+            self._vector_meta[slot] = (key, num_questions, difficulty)
+
+    def _remember(self, key: bytes, payload, created_at: float) -> tuple:
+        entry = self._memory[key] = (payload, created_at)
+        self._memory.move_to_end(key)
+        if len(self._memory) > _MEMORY_CACHE_SIZE:
+            self._memory.popitem(last=False)
+        return entry
@@ -1,17 +1,169 @@
 import google.generativeai as genai
 import os
 import json
+import orjson
 import re
-from typing import List, Dict, Optional
-import traceback
+import hashlib
 import time
+import random
+from pathlib import Path
+from typing import List, Dict, Optional
+import asyncio
 from google.api_core import exceptions
+from pydantic import TypeAdapter, ValidationError
+from models.schemas import Question
+from services.quiz_cache import QuizCache
+from database.database import question_digest
+
+# Output-token budget per question (text, 4 options, answer index, bloom level as JSON) plus slack
+# for the array itself; capped at the models' output limit. Only models that don't think get the
+# tight budget: thinking tokens count against max_output_tokens, so the others get the full limit
+OUTPUT_TOKENS_PER_QUESTION = 160
+MAX_OUTPUT_TOKENS = 8192
+
+# Quizzes of at least 2 * QUESTIONS_PER_SHARD questions are split across up to MAX_SHARDS
+# concurrent prompts over disjoint topic groups
+QUESTIONS_PER_SHARD = 6
+MAX_SHARDS = 3
+
+# Hedged requests: up to RACE_WIDTH models from the top of the priority list per prompt, but the
+# next one only starts if the previous hasn't answered within HEDGE_DELAY seconds (or has failed),
+# so a normal prompt costs a single Gemini call even when a quiz is sharded
+RACE_WIDTH = 2
+HEDGE_DELAY = 5.0
+
+# Previously-asked questions quoted in the prompt: the newest ones that fit a token budget
+# (about 4 characters per token, plus the JSON quoting/indent), out of at most PROMPT_HISTORY_SIZE
+# loaded. Older ones are only deduped by hash
+PROMPT_HISTORY_SIZE = 40
+PROMPT_HISTORY_TOKENS = 1000
+
+# Rate-limit backoff: the server's retry delay when given, else exponential (4s, 8s, ...) plus jitter.
+# A model is skipped while its cooldown runs; waits longer than RATE_LIMIT_MAX_WAIT aren't slept
+# through, the next model is tried instead
+RATE_LIMIT_BASE_WAIT = 4.0
+RATE_LIMIT_JITTER = 1.0
+RATE_LIMIT_MAX_WAIT = 30.0
+RATE_LIMIT_COOLDOWN_CAP = 300.0
+
+# Circuit breaker: after this many consecutive non-429 failures a model sits out like a
+# rate-limited one (not raced, tried last) for BREAKER_OPEN_SECONDS; any success resets it
+BREAKER_THRESHOLD = 3
+BREAKER_OPEN_SECONDS = 60.0
+
+# Models tried, in priority order: Flash (fast/cheap) -> Pro (better) -> Legacy, all known to
+# produce good JSON output. Nothing is listed at startup; a model answering 404 is demoted instead
+MODEL_PRIORITY = [
+    "models/gemini-1.5-flash",
+    "models/gemini-flash-latest",
+    "models/gemini-2.0-flash",
+    "models/gemini-1.5-pro",
+    "models/gemini-pro",
+]
+
+# Demoted (404) model names are remembered on disk for a day, then probed again
+MODELS_CACHE_PATH = Path(os.getenv("QUIZGEN_CACHE_DIR", Path.home() / ".cache" / "quizgen")) / "models.json"
+MODELS_CACHE_TTL = 86400
+
+# Connections kept per host for the Gemini REST session (requests' default pool holds 10; sharded
+# prompts and concurrent users open more than that, and surplus sockets are closed after each call)
+REST_POOL_CONNECTIONS = 16
+REST_POOL_MAXSIZE = 64
+
+# A markdown-fenced array (up to the first closing fence). Searched on its own first, so a '[' in
+# the prose before the fence can't start the match
+_FENCED_JSON_RE = re.compile(r"```(?:json)?\s*(\[[\s\S]*?\])\s*```")
+# Unfenced responses: the first '[' through the last ']'
+_BARE_JSON_RE = re.compile(r"\[[\s\S]*\]")
+
+# Reused for the raw_decode fallback in _parse_gemini_response
+_JSON_DECODER = json.JSONDecoder()
+
+# Decodes and schema-checks a response in one pass inside pydantic-core
+_QUESTIONS_ADAPTER = TypeAdapter(List[Question])
+
+# Request-independent part of the prompt, built once. Kept flush-left so the source indentation
+# isn't sent (and billed) as input tokens on every call
+QUIZ_INSTRUCTIONS = """\
+Difficulty Instructions:
+- If "easy": questions should check comprehension and application (Bloom's: Understand/Apply). avoid very simple definitions. Focus on slightly challenging foundational concepts.
+- If "medium": questions should require applying concepts to new situations (Bloom's: Apply/Analyze). Options should be plausible.
+- If "hard": questions should require deep analysis, evaluation, or multi-step problem solving (Bloom's: Evaluate/Create). Options should be subtle.
+
+Format constraints:
+1. Return ONLY a valid JSON array of objects.
+2. Each object must have:
+   - "question": string (The question text)
+   - "options": array of 4 strings (Possible answers)
+   - "correct_answer": integer (0 for A, 1 for B, 2 for C, 3 for D)
+   - "bloom_level": string (One of: "Remember", "Understand", "Apply", "Analyze", "Evaluate", "Create")
+3. Do not include markdown formatting (like ```json), just the raw JSON string.
+4. Do NOT use LaTeX or markdown formatting for math (no $ symbols).
+5. Use UNICODE text for math symbols where possible to make it look professional (e.g. use "A⁻¹" instead of "A^-1", "x²" instead of "x^2", "θ" instead of "theta", "∫" instead of "integral").
+6. Ensure questions are relevant to the topics provided.
+"""
+
+# The per-request part of the prompt, filled with one str.format call
+PROMPT_TEMPLATE = """\
+Create {num_questions} multiple-choice questions (MCQs) based on the following topics: {topics}.
+
+Difficulty Level: {difficulty}
+{previous_context}"""
+
+PREVIOUS_QUESTIONS_TEMPLATE = """\
+IMPORTANT: The user has already been asked the following questions. DO NOT repeat them or generate very similar variations. Create FRESH questions.
+Previously asked:
+{questions}
+"""
+
+# Sent once per model as its system_instruction, so prompts only carry the per-request lines
+SYSTEM_PROMPT = "You are an expert quiz generator.\n\n" + QUIZ_INSTRUCTIONS
+
+
+def _fit_history(questions: List[str], budget: int = PROMPT_HISTORY_TOKENS) -> List[str]:
+    """Newest questions whose estimated token count fits the budget, oldest first"""
+    kept = []
+    used = 0
+    for q in reversed(questions):
+        used += (len(q) + 8) // 4
+        if used > budget:
+            break
+        kept.append(q)
+    kept.reverse()
+    return kept
+
+
+def _supports_system_instruction(model_name: str) -> bool:
+    """Gemini 1.0 models reject system_instruction; they get SYSTEM_PROMPT inline instead"""
+    name = model_name.split("/")[-1]
+    return not (name.startswith("gemini-pro") or name.startswith("gemini-1.0"))
+
+
+def _has_fixed_output_budget(model_name: str) -> bool:
+    """Models released before thinking (1.0/1.5/2.0); gemini-*-latest and newer ones may think"""
+    name = model_name.split("/")[-1]
+    return name.startswith(("gemini-pro", "gemini-1.0", "gemini-1.5", "gemini-2.0"))
+
+
+class OutputTruncated(Exception):
+    """The model stopped at max_output_tokens before finishing the JSON"""
+
 
 class QuizGenerator:
-    def __init__(self):
+    def __init__(self, cache: Optional[QuizCache] = None):
         print("Initializing Quiz Generator with Gemini API...")
         self.api_key = os.getenv("GEMINI_API_KEY")
+        # Identical generation inputs are served from here instead of calling Gemini again
+        self.cache = cache
         self.models_to_try = []
+        # model name -> GenerativeModel, built once instead of per attempt
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        # model name -> time.monotonic() until which it's rate-limited
+        self._model_cooldowns: Dict[str, float] = {}
+        # model name -> consecutive non-429 failures, for the circuit breaker
+        self._model_failures: Dict[str, int] = {}
+        # cache key -> task generating that quiz, so identical concurrent requests share one generation
+        self._inflight: Dict[bytes, asyncio.Task] = {}
 
         if not self.api_key:
             print("WARNING: GEMINI_API_KEY not found in environment variables.")
@@ -19,127 +171,359 @@ class QuizGenerator:
             try:
                 # Force REST transport to avoid gRPC/IPv6 connectivity issues
                 genai.configure(api_key=self.api_key, transport='rest')
+                self._widen_rest_pool()
                 
-                # 1. List available models
-                available_models = []
-                try:
-                    for m in genai.list_models():
-                        if 'generateContent' in m.supported_generation_methods:
-                            available_models.append(m.name)
-                    print(f"Available models: {available_models}")
-                except Exception as e:
-                    print(f"Could not list models: {e}")
-                    # Fallback list if listing fails
-                    available_models = ["models/gemini-1.5-flash", "models/gemini-pro"]
-
-                # 2. Build prioritized list of usable models
-                # Priority: Flash (fast/cheap) -> Pro (better) -> Legacy
-                # We prioritizing models known to produce good JSON output.
-                candidates = [
-                    "gemini-1.5-flash", 
-                    "gemini-flash",
-                    "gemini-2.0-flash", 
-                    "gemini-1.5-pro",
-                    "gemini-pro"
-                ]
-                
-                self.models_to_try = []
-                
-                # Only add models that match our high-quality candidates list
-                for candidate in candidates:
-                    for m in available_models:
-                        if candidate in m and m not in self.models_to_try:
-                            # Filter out obviously incompatible models
-                            if "tts" in m or "audio" in m:
-                                continue 
-                            self.models_to_try.append(m)
-                
-                # If list is empty (listing failed + no fallback matches), force some defaults
-                if not self.models_to_try:
-                    self.models_to_try = ["models/gemini-1.5-flash", "models/gemini-pro"]
+                # Models this key got a 404 for last time go to the back of the list
+                unavailable = self._load_unavailable_models()
+                self.models_to_try = (
+                    [m for m in MODEL_PRIORITY if m not in unavailable] + [m for m in MODEL_PRIORITY if m in unavailable]
+                )
                     
                 print(f"Model priority list: {self.models_to_try}")
+                self._models = {
+                    name: genai.GenerativeModel(name, system_instruction=SYSTEM_PROMPT)
+                    if _supports_system_instruction(name) else genai.GenerativeModel(name)
+                    for name in self.models_to_try
+                }
                 
             except Exception as e:
                 print(f"Error configuring Gemini API: {e}")
                 self.models_to_try = []
+                self._models = {}
+
+    def _models_cache_key(self) -> str:
+        # Model access depends on the key, so the file is only valid for the key that wrote it
+        return hashlib.sha256(self.api_key.encode()).hexdigest()[:16]
 
-    def generate_quiz(self, topics: List[str], num_questions: int = 10, difficulty: str = "medium", previous_questions: List[str] = None) -> Dict:
-        """Generate quiz questions using Gemini API with robust fallback and retries"""
+    def _load_unavailable_models(self) -> List[str]:
+        """Model names demoted after a 404, from the on-disk file while it's fresh"""
+        try:
+            if time.time() - MODELS_CACHE_PATH.stat().st_mtime < MODELS_CACHE_TTL:
+                cached = orjson.loads(MODELS_CACHE_PATH.read_bytes())
+                if cached.get("key") == self._models_cache_key():
+                    return cached["unavailable"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass  # Missing, stale or unreadable: try every model
+        return []
+
+    def _demote_model(self, model_name: str):
+        """Move a model that answered 404 to the back of the list, here and for future runs"""
+        if self.models_to_try[-1:] == [model_name]:
+            return
+        print(f"Model {model_name} not found. Moving it to the end of the priority list...")
+        self.models_to_try = [m for m in self.models_to_try if m != model_name] + [model_name]
+        unavailable = [m for m in self._load_unavailable_models() if m != model_name] + [model_name]
+        try:
+            MODELS_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename, so a concurrent start never reads a half-written file
+            tmp_path = MODELS_CACHE_PATH.with_name(f"{MODELS_CACHE_PATH.name}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(orjson.dumps({"key": self._models_cache_key(), "unavailable": unavailable}))
+            os.replace(tmp_path, MODELS_CACHE_PATH)
+        except OSError as e:
+            print(f"Could not save model list: {e}")
+
+    def _widen_rest_pool(self):
+        """Give the SDK's shared REST session a larger keep-alive pool"""
+        try:
+            from requests.adapters import HTTPAdapter
+            from google.generativeai import client as genai_client
+            # Every GenerativeModel goes through this default client and its AuthorizedSession
+            session = genai_client.get_default_generative_client()._transport._session
+            if getattr(session, "is_mtls", False):
+                return  # Keep the client-certificate adapter google-auth mounted
+            session.mount("https://", HTTPAdapter(pool_connections=REST_POOL_CONNECTIONS, pool_maxsize=REST_POOL_MAXSIZE))
+        except Exception as e:
+            # Private SDK internals; the default pool still works, just smaller
+            print(f"Could not resize Gemini connection pool: {e}")
+
+    async def generate_quiz(self, topics: List[str], num_questions: int = 10, difficulty: str = "medium", previous_questions: List[str] = None, previous_hashes: Optional[frozenset] = None) -> Dict:
+        """Generate quiz questions using Gemini API with robust fallback and retries.
+        previous_hashes (question_digest values) covers the full history when previous_questions is only the recent tail"""
         print(f"Generating {num_questions} questions for topics: {topics[:3]}...")
         
+        cache_key = QuizCache.make_key(topics, num_questions, difficulty, previous_questions)
+        # Adaptive quizzes depend on the session's history, so only fresh ones match by similarity
+        semantic = not previous_questions and not previous_hashes
+        if self.cache:
+            # SQLite read + decompress, off the event loop
+            cached = await asyncio.to_thread(self._cached_quiz, cache_key, topics, num_questions, difficulty, semantic)
+            if cached:
+                quiz, stale = cached
+                if stale:
+                    # Stale-while-revalidate: this caller gets the aging quiz now, the next one a fresh copy
+                    self._refresh_in_background(topics, num_questions, difficulty, previous_questions, previous_hashes, cache_key, semantic)
+                return quiz
+        
         if not self.models_to_try:
             print("No models available.")
             raise Exception("AI Service Unavailable: No models detected. Please check API Key.")
 
+        task = self._inflight.get(cache_key)
+        if task is not None:
+            print("Joining identical in-flight generation")
+            # Shielded: a caller going away must not cancel the generation for the others.
+            # Joiners get their own copy of the shared result
+            return orjson.loads(orjson.dumps(await asyncio.shield(task)))
+        
+        task = asyncio.create_task(
+            self._generate_uncached(topics, num_questions, difficulty, previous_questions, previous_hashes, cache_key, semantic)
+        )
+        self._inflight[cache_key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        return await asyncio.shield(task)
+
+    async def _generate_uncached(self, topics: List[str], num_questions: int, difficulty: str, previous_questions: Optional[List[str]], previous_hashes: Optional[frozenset], cache_key: bytes, semantic: bool) -> Dict:
+        """Call the models for a quiz that missed the cache, then dedup and store it"""
+        shards = self._shard_topics(topics, num_questions)
+        if len(shards) == 1:
+            quiz = await self._generate_shard(topics, num_questions, difficulty, previous_questions)
+        else:
+            # Several short decodes in flight finish well before one long one
+            print(f"Splitting into {len(shards)} concurrent prompts")
+            results = await asyncio.gather(
+                *(self._generate_shard(shard_topics, shard_count, difficulty, previous_questions)
+                  for shard_topics, shard_count in shards),
+                return_exceptions=True
+            )
+            quiz = self._merge_shards(results, topics, difficulty)
+        
+        # Hash the history once (or reuse the stored digests); each generated question is then an O(1) membership check
+        seen_questions = previous_hashes if previous_hashes is not None else frozenset(question_digest(q) for q in previous_questions or ())
+        quiz["questions"] = self._drop_repeated_questions(quiz["questions"], seen_questions)
+        if self.cache and not quiz.get("partial"):
+            await asyncio.to_thread(self._store_quiz, cache_key, quiz, topics, num_questions, difficulty, semantic)
+        return quiz
+
+    def _refresh_in_background(self, topics: List[str], num_questions: int, difficulty: str, previous_questions: Optional[List[str]], previous_hashes: Optional[frozenset], cache_key: bytes, semantic: bool):
+        """Regenerate a stale cache entry without making anyone wait; skipped if it's already being generated"""
+        if not self.models_to_try or cache_key in self._inflight:
+            return
+        print("Cached quiz is stale, refreshing it in the background")
+        task = asyncio.create_task(
+            self._generate_uncached(topics, num_questions, difficulty, previous_questions, previous_hashes, cache_key, semantic)
+        )
+        # Registered as in-flight, so a cache miss meanwhile joins it instead of starting another
+        self._inflight[cache_key] = task
+        
+        def done(task: asyncio.Task):
+            self._inflight.pop(cache_key, None)
+            # The stale entry stays until its hard TTL, so a failed refresh is only logged
+            if not task.cancelled() and task.exception() is not None:
+                print(f"Background refresh failed: {task.exception()}")
+        task.add_done_callback(done)
+
+    def _cached_quiz(self, cache_key: bytes, topics: List[str], num_questions: int, difficulty: str, semantic: bool) -> Optional[tuple]:
+        """(quiz, stale) for an exact cache hit, else (for fresh quizzes) one for near-identical topics; runs in a worker thread"""
+        cached = self.cache.lookup(cache_key)
+        if cached:
+            print("Serving quiz from cache")
+            return cached
+        if semantic:
+            cached = self.cache.find_similar(topics, num_questions, difficulty)
+            if cached:
+                print("Serving quiz from semantic cache")
+                return cached
+        return None
+
+    def _store_quiz(self, cache_key: bytes, quiz: Dict, topics: List[str], num_questions: int, difficulty: str, semantic: bool):
+        """Write a generated quiz to the cache (and the similarity index); runs in a worker thread"""
+        self.cache.set(cache_key, quiz)
+        if semantic:
+            self.cache.index_topics(cache_key, topics, num_questions, difficulty)
+
+    def _shard_topics(self, topics: List[str], num_questions: int) -> List[tuple]:
+        """Split a large request into (topics, num_questions) shards; small ones stay whole"""
+        shard_count = min(MAX_SHARDS, len(topics), num_questions // QUESTIONS_PER_SHARD)
+        if shard_count < 2:
+            return [(topics, num_questions)]
+        
+        # Round-robin the topics so every shard gets a spread of the syllabus
+        base, extra = divmod(num_questions, shard_count)
+        return [
+            (topics[i::shard_count], base + (1 if i < extra else 0))
+            for i in range(shard_count)
+        ]
+
+    def _merge_shards(self, results: List, topics: List[str], difficulty: str) -> Dict:
+        """Combine shard quizzes, keeping whatever succeeded; fails only if every shard failed"""
+        parts, errors = [], []
+        for result in results:
+            if isinstance(result, BaseException):
+                errors.append(result)
+            else:
+                parts.append(result)
+        if not parts:
+            raise errors[0]
+        
+        quiz = {
+            "questions": [q for part in parts for q in part["questions"]],
+            "difficulty": difficulty,
+            "topic_count": len(topics)
+        }
+        if errors:
+            quiz["partial"] = True  # Incomplete, so never cached
+        return quiz
+
+    async def _generate_shard(self, topics: List[str], num_questions: int, difficulty: str, previous_questions: List[str] = None) -> Dict:
+        """Run one prompt through the model priority list, racing the top candidates"""
         prompt = self._create_prompt(topics, num_questions, difficulty, previous_questions)
+        # Greedy decoding with a tight length budget: the schema is fixed, so sampling only adds
+        # variance, and the cap stops a runaway response from decoding thousands of extra tokens
+        generation_config = {
+            "temperature": 0,
+            "candidate_count": 1,
+            "max_output_tokens": min(MAX_OUTPUT_TOKENS, OUTPUT_TOKENS_PER_QUESTION * num_questions + 256),
+        }
+        
+        # Models cooling down after a 429 or an opened breaker aren't raced; they're only tried once
+        # the others failed, soonest-available first
+        now = time.monotonic()
+        ready = [m for m in self.models_to_try if self._model_cooldowns.get(m, 0) <= now]
+        cooling = sorted(
+            (m for m in self.models_to_try if m not in ready), key=lambda m: self._model_cooldowns[m]
+        )
+        racing = ready[:RACE_WIDTH] or cooling[:1]
+        fallbacks = [m for m in ready + cooling if m not in racing]
+        
+        # A slow or rate-limited top model is hedged by the next one instead of delaying the prompt
+        # by its whole backoff schedule; whichever answers first wins
+        racers = []
+        pending = set()
+        try:
+            for i, model_name in enumerate(racing):
+                task = asyncio.create_task(self._try_model(model_name, prompt, generation_config, topics, difficulty))
+                racers.append(task)
+                pending.add(task)
+                hedge_after = HEDGE_DELAY if i < len(racing) - 1 else None
+                while pending:
+                    done, pending = await asyncio.wait(pending, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        break  # No answer yet: start the next model alongside
+                    for finished in done:
+                        if finished.exception() is None:
+                            return finished.result()
+        finally:
+            # Stops the losers at their next await; an HTTP call already in flight finishes in its thread
+            for task in racers:
+                task.cancel()
+        
+        # Remaining models only if every racer failed
+        for model_name in fallbacks:
+            try:
+                return await self._try_model(model_name, prompt, generation_config, topics, difficulty)
+            except Exception:
+                continue
         
-        # Try each model in our priority list
-        for model_name in self.models_to_try:
-            print(f"Attempting generation with model: {model_name}")
-            
-            # Aggressive retry logic with significant backoff for Rate Limits
-            for attempt in range(3): 
-                try:
-                    model = genai.GenerativeModel(model_name)
-                    response = model.generate_content(prompt)
-                    return self._parse_gemini_response(response.text, topics, difficulty)
-                
-                except exceptions.ResourceExhausted:
-                    wait_time = 5 * (attempt + 1) # 5s, 10s, 15s
-                    print(f"Rate limit hit for {model_name} (Attempt {attempt+1}). Waiting {wait_time}s...")
-                    time.sleep(wait_time)
-                    if attempt == 2:
-                        print(f"Rate limit persisted for {model_name}. Switching to next model...")
-                    
-                except Exception as e:
-                    print(f"Error with {model_name} (Attempt {attempt+1}): {e}")
-                    if attempt == 2: # Last attempt for this model
-                        print(f"Model {model_name} failed. Trying next model...")
-                    else:
-                        time.sleep(2) # Short wait before retry same model
-                        
         print("All models failed.")
         # Do NOT fallback to garbage questions. User prefers meaningful error.
         raise Exception("Server Busy: High traffic on AI models. Please try again in 1 minute.")
 
-    def _create_prompt(self, topics: List[str], num_questions: int, difficulty: str, previous_questions: List[str] = None) -> str:
-        topics_str = ", ".join(topics)
+    async def _try_model(self, model_name: str, prompt: str, generation_config: Dict, topics: List[str], difficulty: str) -> Dict:
+        """Generate with one model, retrying with backoff; raises once its attempts are used up"""
+        print(f"Attempting generation with model: {model_name}")
+        contents = prompt if _supports_system_instruction(model_name) else f"{SYSTEM_PROMPT}\n{prompt}"
+        if not _has_fixed_output_budget(model_name):
+            generation_config = {**generation_config, "max_output_tokens": MAX_OUTPUT_TOKENS}
+        
+        # Aggressive retry logic with significant backoff for Rate Limits
+        for attempt in range(3): 
+            try:
+                # The SDK call blocks (REST transport), so it runs in a worker thread
+                response = await asyncio.to_thread(
+                    self._models[model_name].generate_content, contents, generation_config=generation_config
+                )
+                quiz = self._parse_gemini_response(self._response_text(response), topics, difficulty)
+                self._model_failures.pop(model_name, None)
+                return quiz
+            
+            except OutputTruncated as e:
+                # A budget problem, not a failing model: no breaker count, and retried at once with the full limit
+                print(f"{model_name} (Attempt {attempt+1}): {e}")
+                if generation_config["max_output_tokens"] >= MAX_OUTPUT_TOKENS:
+                    raise
+                generation_config = {**generation_config, "max_output_tokens": MAX_OUTPUT_TOKENS}
+            
+            except exceptions.ResourceExhausted as e:
+                retry_after = self._retry_after(e)
+                wait_time = retry_after if retry_after is not None else (
+                    RATE_LIMIT_BASE_WAIT * 2 ** attempt + random.uniform(0, RATE_LIMIT_JITTER)
+                )
+                # Other requests skip this model until the wait is over
+                self._model_cooldowns[model_name] = time.monotonic() + min(wait_time, RATE_LIMIT_COOLDOWN_CAP)
+                if attempt == 2 or wait_time > RATE_LIMIT_MAX_WAIT:
+                    print(f"Rate limit persisted for {model_name} (retry in {wait_time:.0f}s). Switching to next model...")
+                    raise
+                print(f"Rate limit hit for {model_name} (Attempt {attempt+1}). Waiting {wait_time:.1f}s...")
+                await asyncio.sleep(wait_time)
+            
+            except exceptions.NotFound:
+                # Retired or not enabled for this key: retrying won't help
+                await asyncio.to_thread(self._demote_model, model_name)
+                raise
+                
+            except Exception as e:
+                print(f"Error with {model_name} (Attempt {attempt+1}): {e}")
+                failures = self._model_failures[model_name] = self._model_failures.get(model_name, 0) + 1
+                if failures >= BREAKER_THRESHOLD:
+                    # Open the breaker; this call stops here too instead of using up its attempts
+                    self._model_cooldowns[model_name] = max(
+                        self._model_cooldowns.get(model_name, 0), time.monotonic() + BREAKER_OPEN_SECONDS
+                    )
+                    print(f"Model {model_name} failed {failures} times in a row. Skipping it for {BREAKER_OPEN_SECONDS:.0f}s...")
+                    raise
+                if attempt == 2: # Last attempt for this model
+                    print(f"Model {model_name} failed. Trying next model...")
+                    raise
+                await asyncio.sleep(2) # Short wait before retry same model
+
+    @staticmethod
+    def _response_text(response) -> str:
+        """response.text, except that a reply cut off at the output limit raises OutputTruncated"""
+        candidate = response.candidates[0] if response.candidates else None
+        if candidate is not None and getattr(candidate.finish_reason, "name", None) == "MAX_TOKENS":
+            # Often no text parts at all (all thinking), in which case .text would raise a bare ValueError
+            raise OutputTruncated("Response stopped at max_output_tokens")
+        return response.text
+
+    @staticmethod
+    def _retry_after(error: exceptions.ResourceExhausted) -> Optional[float]:
+        """Seconds the server asked us to wait (Retry-After header or RetryInfo detail), if it said"""
+        response = getattr(error, "response", None)
+        header = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+        if header:
+            try:
+                return max(0.0, float(header))
+            except ValueError:
+                pass  # HTTP-date form; fall through to the error details
         
+        for detail in getattr(error, "details", None) or ():
+            if isinstance(detail, dict):
+                # REST error payload: {"@type": ".../google.rpc.RetryInfo", "retryDelay": "37s"}
+                delay = detail.get("retryDelay")
+                if isinstance(delay, str) and delay.endswith("s"):
+                    try:
+                        return max(0.0, float(delay[:-1]))
+                    except ValueError:
+                        continue
+            elif hasattr(detail, "retry_delay"):
+                # gRPC: google.rpc.RetryInfo message
+                return detail.retry_delay.seconds + detail.retry_delay.nanos / 1e9
+        return None
+
+    def _create_prompt(self, topics: List[str], num_questions: int, difficulty: str, previous_questions: List[str] = None) -> str:
         # Add context about previous questions to avoid repetition
+        # Trim to the token budget rather than a fixed count, so long questions can't bloat the prompt
+        recent_questions = _fit_history(previous_questions[-PROMPT_HISTORY_SIZE:]) if previous_questions else []
         previous_context = ""
-        if previous_questions:
-            # Limit to last 20 questions to avoid hitting token limits
-            recent_questions = previous_questions[-20:]
-            previous_context = f"""
-            IMPORTANT: The user has already been asked the following questions. DO NOT repeat them or generate very similar variations. Create FRESH questions.
-            Previously asked:
-            {json.dumps(recent_questions, indent=2)}
-            """
-
-        return f"""
-        You are an expert quiz generator. Create {num_questions} multiple-choice questions (MCQs) based on the following topics: {topics_str}.
-        
-        Difficulty Level: {difficulty}
-        {previous_context}
-        
-        Difficulty Instructions:
-        - If "easy": questions should check comprehension and application (Bloom's: Understand/Apply). avoid very simple definitions. Focus on slightly challenging foundational concepts.
-        - If "medium": questions should require applying concepts to new situations (Bloom's: Apply/Analyze). Options should be plausible.
-        - If "hard": questions should require deep analysis, evaluation, or multi-step problem solving (Bloom's: Evaluate/Create). Options should be subtle.
-        
-        Format constraints:
-        1. Return ONLY a valid JSON array of objects.
-        2. Each object must have:
-           - "question": string (The question text)
-           - "options": array of 4 strings (Possible answers)
-           - "correct_answer": integer (0 for A, 1 for B, 2 for C, 3 for D)
-           - "bloom_level": string (One of: "Remember", "Understand", "Apply", "Analyze", "Evaluate", "Create")
-        3. Do not include markdown formatting (like ```json), just the raw JSON string.
-        4. Do NOT use LaTeX or markdown formatting for math (no $ symbols).
-        5. Use UNICODE text for math symbols where possible to make it look professional (e.g. use "A⁻¹" instead of "A^-1", "x²" instead of "x^2", "θ" instead of "theta", "∫" instead of "integral").
-        6. Ensure questions are relevant to the topics provided.
-        """
+        if recent_questions:
+            previous_context = PREVIOUS_QUESTIONS_TEMPLATE.format(
+                questions=orjson.dumps(recent_questions, option=orjson.OPT_INDENT_2).decode()
+            )
+
+        # Only the per-request lines; the instructions travel as SYSTEM_PROMPT
+        return PROMPT_TEMPLATE.format(
+            num_questions=num_questions, topics=", ".join(topics), difficulty=difficulty, previous_context=previous_context
+        )
 
     
     def _parse_gemini_response(self, response_text: str, topics: List[str], difficulty: str) -> Dict:
@@ -149,16 +533,13 @@ class QuizGenerator:
             # Clean up potential markdown code blocks
             clean_text = self._clean_response(response_text)
             
-            questions = json.loads(clean_text)
-            
-            # Basic validation
-            valid_questions = []
-            for q in questions:
-                if "question" in q and "options" in q and "correct_answer" in q:
-                    if isinstance(q["options"], list) and len(q["options"]) == 4:
-                        if "bloom_level" not in q:
-                            q["bloom_level"] = "Understand" # Default fallback
-                        valid_questions.append(q)
+            try:
+                # Fast path: a well-formed array, every item matching Question (bloom_level defaulted)
+                valid_questions = [
+                    q.model_dump() for q in _QUESTIONS_ADAPTER.validate_json(clean_text) if len(q.options) == 4
+                ]
+            except ValidationError:
+                valid_questions = self._validate_loosely(clean_text)
             
             if not valid_questions:
                  raise ValueError("No valid questions parsed")
@@ -168,53 +549,59 @@ class QuizGenerator:
                 "difficulty": difficulty,
                 "topic_count": len(topics)
             }
-        except (json.JSONDecodeError, ValueError) as e:
+        except (orjson.JSONDecodeError, ValueError) as e:
             print(f"Failed to decode JSON from Gemini: {e}")
             print(f"Raw text chunk: {response_text[:200]}...")
-            return self._generate_fallback_quiz(topics, len(topics) * 2 or 10, difficulty)
+            # Raised into _try_model's retry loop; placeholder questions are never served
+            raise ValueError(f"Unparseable response from Gemini: {e}") from e
+            
+    def _validate_loosely(self, clean_text: str) -> List[Dict]:
+        """Per-item checks for responses the Question schema rejects as a whole"""
+        try:
+            questions = orjson.loads(clean_text)
+        except orjson.JSONDecodeError:
+            # rfind(']') overshoots when the model adds bracketed text after the array;
+            # decode just the first complete value and ignore the trailing text
+            questions, _ = _JSON_DECODER.raw_decode(clean_text)
+        if not isinstance(questions, list):
+            raise ValueError(f"Expected a JSON array, got {type(questions).__name__}")
+        
+        # Basic validation; items of the wrong shape (numbers, strings, null, bad fields) are skipped
+        valid_questions = []
+        for q in questions:
+            if not isinstance(q, dict) or "correct_answer" not in q:
+                continue
+            if isinstance(q.get("question"), str) and isinstance(q.get("options"), list) and len(q["options"]) == 4:
+                if "bloom_level" not in q:
+                    q["bloom_level"] = "Understand" # Default fallback
+                valid_questions.append(q)
+        return valid_questions
             
+    def _drop_repeated_questions(self, questions: List[Dict], seen: frozenset) -> List[Dict]:
+        """Remove questions already asked in this session (or repeated within the quiz)"""
+        # Same guard as the stored history: an item without question text can't be asked or hashed
+        questions = [q for q in questions if isinstance(q.get("question"), str)]
+        seen = set(seen)
+        fresh = []
+        for q in questions:
+            digest = question_digest(q["question"])
+            if digest in seen:
+                continue
+            seen.add(digest)
+            fresh.append(q)
+        
+        if len(fresh) < len(questions):
+            print(f"Dropped {len(questions) - len(fresh)} repeated questions")
+        # If the model only repeated itself, a repeated quiz beats an empty one
+        return fresh or questions
+
     def _clean_response(self, text: str) -> str:
-        """Recursive cleaning of JSON string"""
+        """Pull the JSON array out of the response (inside a ``` fence if present)"""
         print(f"DEBUG: Raw response length: {len(text)}")
         
-        # 1. Remove Markdown
-        if "```json" in text:
-            text = text.split("```json")[1]
-        if "```" in text:
-             text = text.split("```")[0]
-             
-        text = text.strip()
-        
-        # 2. Extract first JSON array [ ... ]
-        # Sometimes model says "Here is the JSON: [ ... ]"
-        start = text.find('[')
-        end = text.rfind(']')
-        
-        if start != -1 and end != -1 and end > start:
-            text = text[start:end+1]
-        
-        return text
-
-    def _generate_fallback_quiz(self, topics: List[str], num_questions: int, difficulty: str) -> Dict:
-        """Simple rule-based fallback if API fails"""
-        questions = []
-        topic_count = len(topics)
-        
-        for i in range(num_questions):
-            topic = topics[i % topic_count] if topics else "General Knowledge"
-            questions.append({
-                "question": f"What is a key aspect of {topic}?",
-                "options": [
-                    f"It is fundamental to the subject.",
-                    "It is unrelated.",
-                    "It is deprecated.",
-                    "None of the above."
-                ],
-                "correct_answer": 0
-            })
-            
-        return {
-            "questions": questions,
-            "difficulty": difficulty,
-            "topic_count": len(topics)
-        }
+        # Sometimes model says "Here is the JSON: [ ... ]" or wraps it in markdown
+        match = _FENCED_JSON_RE.search(text)
+        if match:
+            return match.group(1)
+        match = _BARE_JSON_RE.search(text)
+        return match.group() if match else text.strip()
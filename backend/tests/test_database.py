@@ -0,0 +1,39 @@
+import sqlite3
+
+import orjson
+
+from database.database import Database, question_digest
+
+
+def _legacy_db(path):
+    """A database written before session_question_hashes existed, with the old lax question values"""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE sessions (session_id TEXT PRIMARY KEY, image_path TEXT, extracted_text TEXT, topics TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    conn.execute("CREATE TABLE quizzes (quiz_id TEXT PRIMARY KEY, session_id TEXT, quiz_data TEXT, quiz_type TEXT, difficulty TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    conn.execute("INSERT INTO sessions (session_id, topics) VALUES ('s1', '[\"Algebra\"]')")
+    questions = [{"question": 42}, {"question": None}, {"options": []}, {"question": "What is x?"}]
+    conn.execute("INSERT INTO quizzes (quiz_id, session_id, quiz_data) VALUES ('q1', 's1', ?)", (orjson.dumps({"questions": questions}).decode(),))
+    conn.commit()
+    conn.close()
+
+
+def test_first_start_on_legacy_db_hashes_only_text_questions(tmp_path):
+    path = str(tmp_path / "quiz_data.db")
+    _legacy_db(path)
+    db = Database(path)
+    assert db.get_question_hashes("s1") == frozenset({question_digest("What is x?")})
+    assert db.get_recent_questions_for_session("s1", 10) == ["What is x?"]
+    assert db.get_session("s1")["status"] == "ready"
+
+
+def test_restart_fails_interrupted_uploads_and_allows_one_retry(tmp_path):
+    path = str(tmp_path / "quiz_data.db")
+    db = Database(path)
+    session_id = db.create_session(db.create_user("a@example.com", "a", "hash"), "upload.png", "", [], status="processing")
+    assert not db.retry_session(session_id)  # still processing, nothing to retry
+    
+    db = Database(path)  # process restarted mid-OCR
+    assert db.get_session(session_id)["status"] == "failed"
+    assert db.retry_session(session_id)
+    assert not db.retry_session(session_id)
+    assert db.get_session(session_id)["status"] == "processing"
@@ -0,0 +1,36 @@
+from services.quiz_cache import QuizCache, _SEMANTIC_INDEX_SIZE
+
+
+def _store(cache, topics, question):
+    key = QuizCache.make_key(topics, 6, "easy")
+    cache.set(key, {"questions": [{"question": question}]})
+    cache.index_topics(key, topics, 6, "easy")
+
+
+def test_reindexing_a_key_does_not_push_other_quizzes_out(tmp_path):
+    cache = QuizCache(str(tmp_path / "cache.db"))
+    _store(cache, ["Organic chemistry"], "survivor")
+    # Far more re-stores of one key (e.g. background refreshes) than there are slots
+    for _ in range(_SEMANTIC_INDEX_SIZE + 10):
+        _store(cache, ["Eigenvalues"], "refreshed")
+    
+    quiz, _ = cache.find_similar(["organic chemistry"], 6, "easy")
+    assert quiz["questions"][0]["question"] == "survivor"
+    quiz, _ = cache.find_similar(["eigenvalues"], 6, "easy")
+    assert quiz["questions"][0]["question"] == "refreshed"
+
+
+def test_full_index_evicts_the_oldest_quiz(tmp_path):
+    cache = QuizCache(str(tmp_path / "cache.db"))
+    # Three made-up words per topic list, so hashed embeddings of different lists never coincide
+    topics = [[f"alpha{i} beta{i} gamma{i}"] for i in range(_SEMANTIC_INDEX_SIZE + 1)]
+    for i, topic in enumerate(topics):
+        _store(cache, topic, f"quiz {i}")
+    
+    # The first quiz is still in the cache itself, but no longer findable by similarity
+    assert cache.get(QuizCache.make_key(topics[0], 6, "easy")) is not None
+    assert cache.find_similar(topics[0], 6, "easy") is None
+    quiz, _ = cache.find_similar(topics[1], 6, "easy")
+    assert quiz["questions"][0]["question"] == "quiz 1"
+    quiz, _ = cache.find_similar(topics[-1], 6, "easy")
+    assert quiz["questions"][0]["question"] == f"quiz {_SEMANTIC_INDEX_SIZE}"
@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import orjson
+import pytest
+
+from services.quiz_generator import OutputTruncated, QuizGenerator, _has_fixed_output_budget
+
+
+QUESTION = {"question": "What is 2 + 2?", "options": ["1", "2", "3", "4"], "correct_answer": 3}
+
+
+@pytest.fixture
+def generator():
+    # Parsing needs no API key or models, so skip __init__'s Gemini setup
+    return QuizGenerator.__new__(QuizGenerator)
+
+
+def test_clean_response_ignores_brackets_in_prose_before_fence(generator):
+    array = orjson.dumps([QUESTION]).decode()
+    text = f"Here are the [3] questions you asked for:\n```json\n{array}\n```\nLet me know [if needed]."
+    assert generator._clean_response(text) == array
+    quiz = generator._parse_gemini_response(text, ["Arithmetic"], "easy")
+    assert [q["question"] for q in quiz["questions"]] == [QUESTION["question"]]
+
+
+def test_clean_response_bare_fence_and_unfenced(generator):
+    array = orjson.dumps([QUESTION]).decode()
+    assert generator._clean_response(f"```\n{array}\n```") == array
+    assert generator._clean_response(f"Here is the JSON: {array} Done.") == array
+
+
+def test_loose_parse_skips_items_of_the_wrong_type(generator):
+    items = [
+        1, "text", None, [QUESTION],
+        {"question": None, "options": ["a", "b", "c", "d"], "correct_answer": 0},
+        {"question": "Options not a list", "options": "abcd", "correct_answer": 0},
+        {**QUESTION, "options": [1, 2, 3, 4]},  # rejected by the schema, so this forces the loose path
+    ]
+    quiz = generator._parse_gemini_response(orjson.dumps(items).decode(), ["Arithmetic"], "easy")
+    assert quiz["questions"] == [{**QUESTION, "options": [1, 2, 3, 4], "bloom_level": "Understand"}]
+
+
+@pytest.mark.parametrize("text", ["[1, 2, 3]", '{"question": "not an array"} [x', "[null]"])
+def test_loose_parse_without_questions_is_a_parse_error(generator, text):
+    with pytest.raises(ValueError, match="Unparseable response"):
+        generator._parse_gemini_response(text, ["Arithmetic"], "easy")
+
+
+def test_drop_repeated_questions_skips_items_without_question_text(generator):
+    items = [{"question": None}, {"question": 7}, {"options": []}, QUESTION, {**QUESTION, "question": " what IS 2 + 2? "}]
+    assert generator._drop_repeated_questions(items, frozenset()) == [QUESTION]
+    assert generator._drop_repeated_questions([{"question": None}], frozenset()) == []
+
+
+def test_response_cut_off_at_the_output_limit_is_reported_as_truncated():
+    response = SimpleNamespace(candidates=[SimpleNamespace(finish_reason=SimpleNamespace(name="MAX_TOKENS"))])
+    with pytest.raises(OutputTruncated):
+        QuizGenerator._response_text(response)
+
+
+def test_only_pre_thinking_models_get_the_tight_output_budget():
+    assert _has_fixed_output_budget("models/gemini-1.5-flash")
+    assert _has_fixed_output_budget("models/gemini-pro")
+    assert not _has_fixed_output_budget("models/gemini-flash-latest")
+    assert not _has_fixed_output_budget("models/gemini-2.5-flash")
+
+
+def test_prompt_omits_history_block_when_no_question_fits_the_budget(generator):
+    plain = generator._create_prompt(["Algebra"], 5, "easy")
+    assert generator._create_prompt(["Algebra"], 5, "easy", ["x" * 10000]) == plain
+    assert "Previously asked" in generator._create_prompt(["Algebra"], 5, "easy", ["What is x?"])
@@ -1,7 +1,7 @@
 'use client'
 
 import { useState } from 'react'
-import { uploadImage } from '@/lib/api'
+import { retryTopics, uploadImage, waitForTopics } from '@/lib/api'
 
 interface ImageUploadProps {
   onSuccess: (sessionId: string, topics: string[], previewUrl: string | null) => void
@@ -12,6 +12,8 @@ export default function ImageUpload({ onSuccess }: ImageUploadProps) {
   const [preview, setPreview] = useState<string | null>(null)
   const [uploading, setUploading] = useState(false)
   const [error, setError] = useState<string | null>(null)
+  // Session whose topic extraction failed, so it can be retried without uploading again
+  const [failedSessionId, setFailedSessionId] = useState<string | null>(null)
 
   const handleFileChange = (e: React.ChangeEvent<HTMLInputElement>) => {
     const selectedFile = e.target.files?.[0]
@@ -19,6 +21,7 @@ export default function ImageUpload({ onSuccess }: ImageUploadProps) {
       if (selectedFile.type.startsWith('image/')) {
         setFile(selectedFile)
         setError(null)
+        setFailedSessionId(null)
 
         // Create preview
         const reader = new FileReader()
@@ -38,14 +41,31 @@ export default function ImageUpload({ onSuccess }: ImageUploadProps) {
       return
     }
 
+    await extractTopics(() => uploadImage(file))
+  }
+
+  const handleRetry = async () => {
+    if (failedSessionId) {
+      await extractTopics(() => retryTopics(failedSessionId))
+    }
+  }
+
+  const extractTopics = async (start: () => Promise<any>) => {
     setUploading(true)
     setError(null)
+    setFailedSessionId(null)
 
     try {
-      const result = await uploadImage(file)
-      onSuccess(result.session_id, result.topics, preview)
+      const result = await start()
+      const session = result.status === 'processing' ? await waitForTopics(result.session_id) : result
+      if (session.status === 'failed') {
+        setFailedSessionId(result.session_id)
+        setError('Could not extract topics from this image. Retry, or try another image.')
+        return
+      }
+      onSuccess(result.session_id, session.topics, preview)
     } catch (err: any) {
-      setError(err.response?.data?.detail || 'Upload failed. Please try again.')
+      setError(err.response?.data?.detail || err.message || 'Upload failed. Please try again.')
     } finally {
       setUploading(false)
     }
@@ -111,6 +131,15 @@ export default function ImageUpload({ onSuccess }: ImageUploadProps) {
       {error && (
         <div className="bg-red-50 border border-red-200 text-red-700 px-4 py-3 rounded">
           {error}
+          {failedSessionId && (
+            <button
+              onClick={handleRetry}
+              disabled={uploading}
+              className="ml-2 font-semibold underline hover:text-red-800 disabled:opacity-50"
+            >
+              Retry
+            </button>
+          )}
         </div>
       )}
 
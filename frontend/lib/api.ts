@@ -50,6 +50,24 @@ export const getTopics = async (sessionId: string) => {
   return response.data
 }
 
+// Re-queues topic extraction for a failed (or interrupted) session; poll with waitForTopics afterwards
+export const retryTopics = async (sessionId: string) => {
+  const response = await api.post(`/api/retry-topics/${sessionId}`)
+  return response.data
+}
+
+// Topics are extracted in the background after upload; poll until the session is ready or failed
+export const waitForTopics = async (sessionId: string, intervalMs: number = 1500, maxAttempts: number = 200) => {
+  for (let attempt = 0; attempt < maxAttempts; attempt++) {
+    const data = await getTopics(sessionId)
+    if (data.status !== 'processing') {
+      return data
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs))
+  }
+  throw new Error('Timed out waiting for topic extraction')
+}
+
 export const generateQuiz = async (sessionId: string, numQuestions: number = 10) => {
   const response = await api.post('/api/generate-quiz', {
     session_id: sessionId,